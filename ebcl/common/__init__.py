@@ -1,6 +1,7 @@
 """ Common functions of the EBcL build helpers """
 import logging
 import os
+import stat
 
 from pathlib import Path
 from typing import Callable, Literal, TypeVar, overload
@@ -110,3 +111,27 @@ def get_cache_folder(folder: str) -> str:
         os.makedirs(cache, exist_ok=True)
 
     return cache
+
+
+def get_private_cache_folder(parent: str | Path, name: str) -> str | None:
+    """
+    Get the cache folder name-<uid> in parent, which is private to the current user.
+
+    Unpickling executes code, so pickled data is only cached in a folder
+    which is owned by the user and not accessible for others.
+    Returns None if the folder is not private.
+    """
+    folder = os.path.join(parent, f'{name}-{os.getuid()}')
+    try:
+        os.mkdir(folder, 0o700)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        logging.debug('Creating cache folder %s failed! %s', folder, e)
+        return None
+
+    st = os.lstat(folder)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        logging.warning('Not using cache folder %s, it is not private to the user.', folder)
+        return None
+    return folder
@@ -1,9 +1,11 @@
 """ APT helper functions """
 import glob
 import gzip
+import hashlib
 import logging
 import lzma
 import os
+import pickle
 import tempfile
 import time
 from abc import ABC, abstractmethod
@@ -16,12 +18,16 @@ from urllib.parse import urlparse
 import requests
 from typing_extensions import Self
 
-from . import get_cache_folder
+from . import get_cache_folder, get_private_cache_folder
 from .deb import Package
 from .deb_metadata import DebPackagesInfo, DebReleaseInfo
 from .fake import Fake
 from .types.cpu_arch import CpuArch
 
+# Version of the pickled package indices, to be increased if the
+# attributes of Package or the parsing of the indices change.
+_INDEX_CACHE_FORMAT = 1
+
 
 class AptCache:
     """
@@ -85,13 +91,59 @@ class AptCache:
 
         cache_file = f'{self._get_cache_path(url)}_{time.time()}'
 
+        # Write to a hidden temporary file and rename it, so that concurrent
+        # readers never see partially written cache files.
+        (fd, tmp_file) = tempfile.mkstemp(dir=self._cache_dir, prefix='.')
         file_bytes: list[bytes] = []
-        with open(cache_file, 'wb') as f:
+        with os.fdopen(fd, 'wb') as f:
             for chunk in result.iter_content(chunk_size=512 * 1024):
                 file_bytes.append(chunk)
                 f.write(chunk)
+        os.replace(tmp_file, cache_file)
         return b''.join(file_bytes)
 
+    def _get_index_path(self, url: str) -> str | None:
+        """ Get the path prefix of the parsed index, in a folder private to the user. """
+        folder = get_private_cache_folder(self._cache_dir, 'parsed')
+        if not folder:
+            return None
+        return os.path.join(folder, f'{self._get_cache_path(url).name}.parsed_')
+
+    def get_index(self, url: str, key: str) -> list[Package] | None:
+        """ Get the parsed packages of the index url, if cached for the given key. """
+        index_path = self._get_index_path(url)
+        if not index_path:
+            return None
+
+        try:
+            with open(f'{index_path}{key}', 'rb') as f:
+                packages = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning('Reading parsed index for %s failed! %s', url, e)
+            return None
+
+        logging.debug('Using parsed index for %s.', url)
+        return packages
+
+    def store_index(self, url: str, key: str, packages: list[Package]) -> None:
+        """ Store the parsed packages of the index url for the given key. """
+        index_path = self._get_index_path(url)
+        if not index_path:
+            return
+
+        try:
+            for old in glob.glob(f'{index_path}*'):
+                os.remove(old)
+
+            (fd, tmp_file) = tempfile.mkstemp(dir=os.path.dirname(index_path), prefix='.')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(packages, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, f'{index_path}{key}')
+        except Exception as e:
+            logging.warning('Storing parsed index for %s failed! %s', url, e)
+
     @overload
     def get(self, url: str, encoding: None = None) -> bytes | None:
         ...
@@ -178,6 +230,9 @@ class AptRepo(ABC):
             return NotImplemented
         return self._arch == other._arch and self._url == other._url and self._is_eq(other)
 
+    def __hash__(self) -> int:
+        return hash((self.__class__, self._arch, self._url))
+
     def load_index(self, cache: AptCache) -> None:
         """Load the packages index from the repository."""
         release_file = cache.get(f"{self._url}/{self._meta_path}/InRelease", encoding="utf-8")
@@ -215,23 +270,33 @@ class AptRepo(ABC):
 
     def _parse_packages(self, cache: AptCache, path: str) -> None:
         """Parse a single Packages file"""
-        data: bytes | None = cache.get(f"{self._url}/{self._meta_path}/{path}")
+        url = f"{self._url}/{self._meta_path}/{path}"
+        data: bytes | None = cache.get(url)
         if not data:
             logging.error("Unable to fetch %s (%s)", path, self)
             return
 
-        if path.endswith('.xz'):
-            data = lzma.decompress(data)
-        elif path.endswith('.gz'):
-            data = gzip.decompress(data)
-        else:
-            logging.error('Unknown compression of index %s (%s)! Cannot parse index.', path, self)
-            return
-        content = data.decode(encoding="utf-8", errors="ignore")
-        packages_info = DebPackagesInfo(content)
-        for package in packages_info.packages:
-            package.repo = self.id
-            package.file_url = f"{self._url}/{package.file_url}"
+        # The parsed packages are cached for the index content, repo and format.
+        digest = hashlib.sha256(data + self.id.encode("utf-8")).hexdigest()
+        key = f"v{_INDEX_CACHE_FORMAT}-{digest}"
+        packages = cache.get_index(url, key)
+
+        if packages is None:
+            if path.endswith('.xz'):
+                data = lzma.decompress(data)
+            elif path.endswith('.gz'):
+                data = gzip.decompress(data)
+            else:
+                logging.error('Unknown compression of index %s (%s)! Cannot parse index.', path, self)
+                return
+            content = data.decode(encoding="utf-8", errors="ignore")
+            packages = DebPackagesInfo(content).packages
+            for package in packages:
+                package.repo = self.id
+                package.file_url = f"{self._url}/{package.file_url}"
+            cache.store_index(url, key, packages)
+
+        for package in packages:
             self._packages[package.name].append(package)
 
 
@@ -442,6 +507,9 @@ class Apt:
 
         return self._repo == value._repo
 
+    def __hash__(self) -> int:
+        return hash(self._repo)
+
     @property
     def id(self) -> str:
         """Get a unique identifier for this repo."""
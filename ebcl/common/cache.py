@@ -63,6 +63,8 @@ class CacheBackendSqlite:
 
     def __init__(self, filename: Path) -> None:
         self._con = sqlite3.connect(filename, detect_types=sqlite3.PARSE_DECLTYPES)
+        # Readers don't block the writer and vice versa.
+        self._con.execute("PRAGMA journal_mode=WAL")
 
     def create(self, scan_files: Callable[[], None]) -> None:
         """ Try to create the tables in the database if they do not exist """
@@ -188,15 +190,27 @@ class CacheBackendSqlite:
 
         cur = self._con.cursor()
         cur.row_factory = package_factory
-        # Get all packages matching the name and architecture
-        cur.execute(
-            """
-            SELECT id, name, arch, repo, version, url, file FROM package
-                WHERE name == ?
-                AND   arch == ?
-            """,
-            (name, arch)
-        )
+        if version is not None and relation == VersionRelation.EXACT:
+            # Exact lookup using the unique (name, arch, version) index
+            cur.execute(
+                """
+                SELECT id, name, arch, repo, version, url, file FROM package
+                    WHERE name == ?
+                    AND   arch == ?
+                    AND   version == ?
+                """,
+                (name, arch, version)
+            )
+        else:
+            # Get all packages matching the name and architecture
+            cur.execute(
+                """
+                SELECT id, name, arch, repo, version, url, file FROM package
+                    WHERE name == ?
+                    AND   arch == ?
+                """,
+                (name, arch)
+            )
         packages: Iterable[Package] = cur.fetchall()
         # Filter version matches
         if version is not None:
@@ -350,7 +364,7 @@ class Cache:
                 file_path = Path(root) / file
                 try:
                     package = DebFile(file_path).to_package()
-                    print(package)
+                    logging.debug("Found existing package %s", package)
                 except InvalidFile:
                     logging.info("File %s is invalid and will be deleted", str(file_path))
                     file_path.unlink()
@@ -1,5 +1,7 @@
 """ Yaml loading helpers. """
 import glob
+import hashlib
+import json
 import logging
 import os
 import tempfile
@@ -8,7 +10,13 @@ from typing import Any, Optional
 
 import yaml
 
-from . import log_exception
+try:
+    # Use the libyaml based loader if PyYAML was built with libyaml support.
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader  # type: ignore[assignment]
+
+from . import get_cache_folder, log_exception
 
 from .apt import Apt
 from .fake import Fake
@@ -40,7 +48,8 @@ class Config:
         'use_bootstrap_package', 'bootstrap_package', 'bootstrap', 'kiwi_root_overlays',
         'use_kiwi_defaults', 'kiwi_scripts', 'kvm', 'image_version', 'type',
         'root_password', 'hostname', 'domain', 'console', 'sysroot_packages',
-        'sysroot_defaults', 'primary_distro', 'base', 'debootstrap_flags', 'install_recommends'
+        'sysroot_defaults', 'primary_distro', 'base', 'debootstrap_flags', 'install_recommends',
+        'compression'
     ]
 
     def __init__(self, config_file: str, output_path: str) -> None:
@@ -141,6 +150,8 @@ class Config:
         self.sysroot_defaults: bool = True
         # Install recommends (defaults to true, to keep behavior)
         self.install_recommends: bool = True
+        # Compression of the initrd image (defaults to uncompressed)
+        self.compression: Optional[str] = None
 
         self.parse()
 
@@ -153,8 +164,39 @@ class Config:
             self.fake.run_sudo(f'rm -rf {self.target_dir}')
 
     def _load_yaml(self, file: str) -> dict[str, Any]:
+        """ Load a yaml file, using a JSON copy from the cache if the file is unchanged. """
+        stat = os.stat(file)
+        key = hashlib.sha1(os.path.abspath(file).encode('utf-8')).hexdigest()
+        cache_folder = get_cache_folder('yaml')
+        cache_file = os.path.join(cache_folder, f'{key}-{stat.st_mtime_ns}-{stat.st_size}.json')
+
+        if os.path.isfile(cache_file):
+            logging.debug('Using cached config %s for %s.', cache_file, file)
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                logging.warning('Reading cached config %s failed! %s', cache_file, e)
+
         with open(file, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f)
+            config = yaml.load(f, Loader=SafeLoader)
+
+        try:
+            data = json.dumps(config)
+            # Only cache configs which survive the JSON round trip unchanged,
+            # e.g. no dates or non-string keys.
+            if json.loads(data) == config:
+                for old in glob.glob(os.path.join(cache_folder, f'{key}-*.json')):
+                    os.remove(old)
+
+                tmp_file = f'{cache_file}.{os.getpid()}'
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(tmp_file, cache_file)
+        except Exception as e:
+            logging.debug('Caching config %s failed! %s', file, e)
+
+        return config
 
     def parse(self) -> None:
         """ Load yaml configuration. """
@@ -436,6 +478,9 @@ class Config:
         if 'install_recommends' in config:
             self.install_recommends = config.get('install_recommends', True)
 
+        if 'compression' in config:
+            self.compression = config.get('compression', None)
+
         for key in config.keys():
             if key not in self.keywords:
                 logging.warning(
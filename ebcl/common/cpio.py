@@ -0,0 +1,97 @@
+""" Writer for cpio archives in the newc format, as used for initrds. """
+import os
+import stat
+
+from typing import BinaryIO, Optional
+
+
+_MAGIC = b'070701'
+_TRAILER = b'TRAILER!!!'
+_COPY_SIZE = 1024 * 1024
+
+
+def _pad(size: int, alignment: int = 4) -> bytes:
+    """ Get the padding to the next multiple of alignment. """
+    return b'\0' * (-size % alignment)
+
+
+def _header(name: bytes, st: Optional[os.stat_result], size: int, nlink: int) -> bytes:
+    """ Create the header and the padded name of an entry. """
+    if st is None:
+        fields = [0, 0, 0, 0, nlink, 0, size, 0, 0, 0, 0]
+    else:
+        fields = [
+            st.st_ino, st.st_mode, st.st_uid, st.st_gid, nlink, int(st.st_mtime), size,
+            os.major(st.st_dev), os.minor(st.st_dev), os.major(st.st_rdev), os.minor(st.st_rdev)
+        ]
+    # name size including the terminating null byte, and the unused check field
+    fields += [len(name) + 1, 0]
+    header = _MAGIC + b''.join(b'%08X' % (field & 0xFFFFFFFF) for field in fields) + name + b'\0'
+    return header + _pad(len(header))
+
+
+def _write_entry(out: BinaryIO, path: str, name: str) -> int:
+    """ Write one file, folder, link or device node. Returns the written bytes. """
+    st = os.lstat(path)
+    encoded_name = os.fsencode(name)
+
+    if stat.S_ISREG(st.st_mode):
+        # Hard links are stored as separate files.
+        header = _header(encoded_name, st, st.st_size, 1)
+        out.write(header)
+        remaining = st.st_size
+        with open(path, 'rb') as f:
+            while remaining:
+                data = f.read(min(remaining, _COPY_SIZE))
+                if not data:
+                    raise OSError(f'File {path} was truncated while writing the archive!')
+                out.write(data)
+                remaining -= len(data)
+        out.write(_pad(st.st_size))
+        return len(header) + st.st_size + len(_pad(st.st_size))
+
+    if stat.S_ISLNK(st.st_mode):
+        target = os.fsencode(os.readlink(path))
+        header = _header(encoded_name, st, len(target), 1)
+        out.write(header + target + _pad(len(target)))
+        return len(header) + len(target) + len(_pad(len(target)))
+
+    nlink = st.st_nlink if stat.S_ISDIR(st.st_mode) else 1
+    header = _header(encoded_name, st, 0, nlink)
+    out.write(header)
+    return len(header)
+
+
+def write_newc(root: str, out: BinaryIO) -> None:
+    """ Write the content of root as cpio newc archive to out.
+
+    The entries are named like the output of "find .", run in root,
+    and each folder is written before its content. The entries of a
+    folder are sorted by name, to get reproducible archives.
+    The ownership and modes of the files are preserved, so the
+    process must be able to read all files in root.
+    """
+    written = _write_entry(out, root, '.')
+
+    stack = [(root, '.')]
+    while stack:
+        (path, name) = stack.pop()
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+
+        folders = []
+        for entry in entries:
+            entry_name = f'{name}/{entry.name}'
+            written += _write_entry(out, entry.path, entry_name)
+            if entry.is_dir(follow_symlinks=False):
+                folders.append((entry.path, entry_name))
+
+        # The folders are processed in order, depth first.
+        stack.extend(reversed(folders))
+
+    trailer = _header(_TRAILER, None, 0, 1)
+    out.write(trailer)
+    written += len(trailer)
+
+    # Pad the archive to full blocks, like cpio does.
+    out.write(_pad(written, 512))
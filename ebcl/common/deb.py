@@ -2,6 +2,7 @@ import itertools
 import logging
 import os
 import subprocess
+import sys
 import tempfile
 
 from pathlib import Path
@@ -17,10 +18,33 @@ from .version import PackageRelation, Version, VersionDepends, VersionRelation
 from .types.cpu_arch import CpuArch
 
 
+# Read size for copying the members of deb archives.
+_COPY_SIZE = 1024 * 1024
+
+
 class InvalidFile(Exception):
     """Invalid debian package"""
 
 
+def _extract_ar(archive: str, location: str) -> None:
+    """ Extract all members of an ar archive, e.g. a deb, to location. """
+    with open(archive, 'rb') as f:
+        ar = unix_ar.open(f)
+        # Like unix_ar, extract only the last member of a name.
+        members = {member.name: member for member in ar.infolist()}
+        for name, member in members.items():
+            target = os.path.join(location, os.path.basename(os.fsdecode(name).rstrip('/')))
+            f.seek(member.offset + 60)
+            with open(target, 'wb') as out:
+                remaining = member.size
+                while remaining:
+                    data = f.read(min(remaining, _COPY_SIZE))
+                    if not data:
+                        raise InvalidFile(f'Member {target} of {archive} is truncated!')
+                    out.write(data)
+                    remaining -= len(data)
+
+
 class Package:
     """ APT package information. """
 
@@ -30,6 +54,7 @@ class Package:
     version: Version | None
     file_url: str | None
     local_file: str | None
+    sha256: str | None
 
     pre_depends: list[list[VersionDepends]]
     depends: list[list[VersionDepends]]
@@ -88,15 +113,19 @@ class Package:
         repo: str,
         version: Version | None = None,
         file_url: str | None = None,
-        local_file: str | None = None
+        local_file: str | None = None,
+        sha256: str | None = None
     ) -> None:
-        self.name: str = name
+        # Package names are compared and used as dict keys very often.
+        self.name: str = sys.intern(name)
         self.arch: CpuArch = arch
         self.repo: str = repo
 
         self.version = version
         self.file_url = file_url
         self.local_file = local_file
+        # SHA256 checksum of the deb file, if known from the package index.
+        self.sha256 = sha256
 
         self.pre_depends = []
         self.depends = []
@@ -152,9 +181,7 @@ class Package:
         logging.debug('Extracting deb content of %s to %s.',
                       self.local_file, deb_content_location)
         try:
-            file = unix_ar.open(self.local_file)
-            logging.debug('ar-file: %s', file)
-            file.extractall(deb_content_location)
+            _extract_ar(self.local_file, deb_content_location)
         except Exception as e:
             logging.error('Extraction of deb %s (%s) failed! %s',
                           self.local_file, self.name, e)
@@ -94,6 +94,7 @@ class DebPackagesInfo:
                 arch = CpuArch.UNDEFINED
             pkg = deb.Package(stanza.get("package", ""), arch, "filled-later")
             pkg.file_url = stanza.get("filename")
+            pkg.sha256 = stanza.get("sha256")
             pkg.version = Version(stanza.get("version", ""))
 
             for key, rel in self.RELATIONS:
@@ -2,8 +2,10 @@
 import glob
 import logging
 import os
-import tempfile
+import shutil
+import stat
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional, Tuple, Any
 
@@ -26,6 +28,36 @@ class FileNotFound(Exception):
     """ Raised if a command returns and returncode which is not 0. """
 
 
+# Compressors by archive extension, the first installed one is used.
+_TAR_COMPRESSORS: dict[tuple[str, ...], list[str]] = {
+    ('.tar.zst', '.tzst'): ['zstd -T0 -3'],
+    ('.tar.xz', '.txz'): ['xz -T0'],
+    ('.tar.gz', '.tgz'): [f'pigz -p {os.cpu_count() or 1}', 'gzip'],
+}
+
+
+def _tar_compress_program(archive_name: str) -> Optional[str]:
+    """ Get the compression program for the archive, None if uncompressed. """
+    for extensions, programs in _TAR_COMPRESSORS.items():
+        if not archive_name.endswith(extensions):
+            continue
+
+        for program in programs:
+            if shutil.which(program.split(' ', 1)[0]):
+                return program
+
+        logging.warning('No compressor for %s found (%s), the archive is not compressed!',
+                        archive_name, ', '.join(p.split(' ', 1)[0] for p in programs))
+        return None
+
+    return None
+
+
+def _paths_overlap(a: str, b: str) -> bool:
+    """ Check if the normalized paths are equal or one contains the other. """
+    return a == b or a.startswith(f'{b.rstrip("/")}/') or b.startswith(f'{a.rstrip("/")}/')
+
+
 def sub_output_path(path: str, output_path: Optional[str] = None) -> str:
     """ Replace $$RESULTS$$ with output path.  """
     if '$$RESULTS$$' in path:
@@ -35,8 +67,7 @@ def sub_output_path(path: str, output_path: Optional[str] = None) -> str:
         if path.endswith('$$RESULTS$$'):
             path = output_path
         else:
-            parts = path.split('$$RESULTS$$/')
-            path = os.path.abspath(os.path.join(output_path, parts[-1]))
+            path = os.path.abspath(os.path.join(output_path, path.rpartition('$$RESULTS$$/')[2]))
 
     return path
 
@@ -53,7 +84,7 @@ class Files:
         env: Optional[EnvironmentType],
         cwd: Optional[str] = None,
         check: bool = True,
-        capture_output=True
+        capture_output: bool = True
     ) -> Optional[Tuple[Optional[str], Optional[str], int]]:
         """ Run the cmd using fake. """
         if env == EnvironmentType.FAKEROOT:
@@ -77,18 +108,44 @@ class Files:
         elif env == EnvironmentType.SHELL or env is None:
             return self.fake.run_cmd(cmd, cwd=cwd, check=check, capture_output=capture_output)
 
+    def _run_cmds(
+        self,
+        cmds: list[str],
+        env: Optional[EnvironmentType],
+        cwd: Optional[str] = None
+    ) -> Optional[Tuple[Optional[str], Optional[str], int]]:
+        """ Run the cmds as one shell command, stop at the first failure. """
+        cmd = ' && '.join(cmds)
+        if len(cmds) > 1 and env in (EnvironmentType.FAKEROOT, EnvironmentType.CHROOT):
+            # fakeroot and chroot only wrap the first command of a list.
+            cmd = f"sh -c '{cmd}'"
+        return self._run_cmd(cmd, env, cwd=cwd)
+
     def copy_files(
         self,
         files: list[dict[str, Any]],
         target_dir: Optional[str] = None,
         fix_ownership: bool = False
-    ) -> None:
-        """ Copy files. """
+    ) -> list[str]:
+        """ Copy files.
+
+        The entries are copied in parallel. Entries with overlapping
+        destinations, e.g. a folder and a file inside of it, are copied
+        in the given order. Returns the paths of the copied files.
+        """
         # TODO: test
-        logging.debug('Files: %s', files)
+        # Check the log level once instead of dispatching per entry.
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        if debug:
+            logging.debug('Files: %s', files)
 
-        for entry in files:
-            logging.info('Processing entry: %s', entry)
+        # Groups of valid entries with overlapping destinations,
+        # as destination paths and (index, destination, entry) tuples.
+        groups: list[tuple[list[str], list[tuple[int, str, dict[str, Any]]]]] = []
+
+        for index, entry in enumerate(files):
+            if debug:
+                logging.debug('Processing entry: %s', entry)
 
             source = entry.get('source', None)
             if not source:
@@ -96,8 +153,6 @@ class Files:
                     'Invalid file entry %s, source is missing!', entry)
                 continue
 
-            src: str = source
-
             if not target_dir:
                 target_dir = self.target_dir
 
@@ -109,24 +164,59 @@ class Files:
             if file_dest:
                 dst = os.path.join(dst, file_dest)
 
-            mode: str = entry.get('mode', None)
-            uid: int = int(entry.get('uid', 0))
-            gid: int = int(entry.get('gid', 0))
+            path = os.path.abspath(dst)
+            dsts = [path]
+            items = [(index, dst, entry)]
+            remaining = []
+            for group in groups:
+                if any(_paths_overlap(path, other) for other in group[0]):
+                    dsts.extend(group[0])
+                    items.extend(group[1])
+                else:
+                    remaining.append(group)
+            # Keep the config order within the group.
+            items.sort(key=lambda item: item[0])
+            groups = remaining + [(dsts, items)]
+
+        if not groups:
+            return []
+
+        def copy_entries(items: list[tuple[int, str, dict[str, Any]]]) -> dict[int, list[str]]:
+            copied: dict[int, list[str]] = {}
+            for (index, dst, entry) in items:
+                src: str = entry['source']
+                mode: str = entry.get('mode', None)
+                uid: int = int(entry.get('uid', 0))
+                gid: int = int(entry.get('gid', 0))
+
+                if debug:
+                    logging.debug('Copying files %s', src)
+
+                copied_files = self.copy_file(
+                    src=src,
+                    dst=dst,
+                    uid=uid,
+                    gid=gid,
+                    mode=mode,
+                    delete_if_exists=True,
+                    fix_ownership=fix_ownership
+                )
 
-            logging.debug('Copying files %s', src)
+                if not copied_files:
+                    raise FileNotFound(f'File {src} not found!')
 
-            copied_files = self.copy_file(
-                src=src,
-                dst=dst,
-                uid=uid,
-                gid=gid,
-                mode=mode,
-                delete_if_exists=True,
-                fix_ownership=fix_ownership
-            )
+                copied[index] = copied_files
 
-            if not copied_files:
-                raise FileNotFound(f'File {src} not found!')
+            return copied
+
+        copied: dict[int, list[str]] = {}
+        workers = min(32, (os.cpu_count() or 1) * 4, len(groups))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(copy_entries, items) for (_dsts, items) in groups]
+            for future in futures:
+                copied.update(future.result())
+
+        return [f for index in sorted(copied) for f in copied[index]]
 
     def copy_file(
         self,
@@ -142,6 +232,7 @@ class Files:
     ) -> list[str]:
         """ Copy file or dir to target environment"""
         files: list[str] = []
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
 
         if environment == EnvironmentType.CHROOT:
             if not self.target_dir:
@@ -153,15 +244,23 @@ class Files:
 
             if src.startswith('/'):
                 src = src[1:]
-            matches = glob.glob(f'{self.target_dir}/{src}')
+            src = f'{self.target_dir}/{src}'
         else:
             dst = os.path.abspath(dst)
-            matches = glob.glob(src)
 
-        for file in matches:
-            file = os.path.abspath(file)
+        # Normalize the pattern once, the matches of an absolute,
+        # normalized pattern are absolute and normalized as well.
+        matches = glob.glob(os.path.abspath(src))
 
-            if os.path.isfile(file):
+        for file in matches:
+            # Stat the source only once.
+            file_stat: Optional[os.stat_result]
+            try:
+                file_stat = os.stat(file)
+            except OSError:
+                file_stat = None
+
+            if file_stat and stat.S_ISREG(file_stat.st_mode):
                 if os.path.exists(dst):
                     if os.path.isdir(dst):
                         # copy file to dir
@@ -183,43 +282,44 @@ class Files:
                     self.fake.run_sudo(
                         f'chown -R {os.getuid()}:{os.getgid()} {file}')
 
+                # All steps of the copy run as one batch, i.e. one subprocess.
                 # Create target directory if it does not exist.
-                self._run_cmd(
-                    f'mkdir -p {os.path.dirname(target)}',
-                    environment, check=False)
+                cmds = [f'{{ mkdir -p {os.path.dirname(target)} || true; }}']
 
-                is_dir = os.path.isdir(file)
-                if is_dir:
-                    logging.debug('File %s is a dir...', file)
-                else:
-                    logging.debug('File %s is a file...', file)
+                is_dir = bool(file_stat and stat.S_ISDIR(file_stat.st_mode))
+                if debug:
+                    logging.debug('File %s is a %s...', file,
+                                  'dir' if is_dir else 'file')
 
                 if delete_if_exists and not is_dir:
                     # Delete the target file or folder if it exists.
-                    self._run_cmd(f'rm -rf {target}', environment)
+                    cmds.append(f'rm -rf {target}')
 
                 if move:
-                    self._run_cmd(f'mv {file} {target}', environment)
+                    cmds.append(f'mv {file} {target}')
                 else:
                     if is_dir:
-                        self._run_cmd(
-                            f'rsync -a {file} {target}', environment)
+                        cmds.append(f'rsync -a {file} {target}')
                         target = os.path.join(target, os.path.basename(file))
                     else:
-                        self._run_cmd(f'cp {file} {target}', environment)
+                        cmds.append(f'cp {file} {target}')
 
                 if uid:
-                    self._run_cmd(f'chown {uid} {target}', environment)
+                    cmds.append(f'chown {uid} {target}')
                 if gid:
-                    self._run_cmd(f'chown :{gid} {target}', environment)
+                    cmds.append(f'chown :{gid} {target}')
 
                 if not mode and not move:
                     # Take over mode from source file.
-                    mode = oct(os.stat(file).st_mode)
+                    if file_stat is None:
+                        file_stat = os.stat(file)
+                    mode = oct(file_stat.st_mode)
                     mode = mode[-4:]
 
                 if mode:
-                    self._run_cmd(f'chmod {mode} {target}', environment)
+                    cmds.append(f'chmod {mode} {target}')
+
+                self._run_cmds(cmds, environment)
 
             else:
                 logging.debug(
@@ -229,6 +329,76 @@ class Files:
 
         return files
 
+    def move_dir_contents(
+        self,
+        src: str,
+        dst: str,
+        fix_ownership: bool = False
+    ) -> list[str]:
+        """ Move all entries of the folder src to the folder dst. """
+        if fix_ownership:
+            # Change owner to host user and group.
+            self.fake.run_sudo(
+                f'chown -R {os.getuid()}:{os.getgid()} {src}')
+
+        os.makedirs(dst, exist_ok=True)
+
+        files: list[str] = []
+
+        with os.scandir(src) as entries:
+            for entry in entries:
+                target = os.path.join(dst, entry.name)
+
+                logging.info('Moving file %s to %s...', entry.path, target)
+
+                target_is_dir = os.path.isdir(target) and not os.path.islink(target)
+
+                if entry.is_dir(follow_symlinks=False) and target_is_dir:
+                    # Merge into the existing folder, shutil.move would
+                    # move the folder into it.
+                    shutil.copytree(entry.path, target, symlinks=True, dirs_exist_ok=True)
+                    shutil.rmtree(entry.path)
+                    files.append(target)
+                    continue
+
+                if os.path.lexists(target):
+                    # Delete the target file or folder if it exists.
+                    if target_is_dir:
+                        shutil.rmtree(target)
+                    else:
+                        os.remove(target)
+
+                files.append(shutil.move(entry.path, target))
+
+        return files
+
+    def clone_files(
+        self,
+        files: list[str],
+        src_dir: str,
+        dst_dir: str
+    ) -> None:
+        """ Clone files below src_dir to the same relative paths below dst_dir.
+
+        Mode and ownership are preserved, so the entries don't need to be
+        processed again. On filesystems supporting reflinks no data is copied.
+        """
+        src_dir = os.path.abspath(src_dir)
+        paths = [os.path.relpath(f, src_dir) for f in files]
+        paths = [p for p in paths if p != '.' and not p.startswith('..')]
+
+        if not paths:
+            return
+
+        os.makedirs(dst_dir, exist_ok=True)
+
+        # Limit the command line length.
+        for i in range(0, len(paths), 512):
+            chunk = ' '.join(f"'{p}'" for p in paths[i:i + 512])
+            self.fake.run_sudo(
+                f'cp -a --reflink=auto --parents {chunk} {os.path.abspath(dst_dir)}',
+                cwd=src_dir)
+
     def run_scripts(
         self,
         scripts: list[dict[str, str]],
@@ -339,18 +509,14 @@ class Files:
             logging.error('Archive is no file!')
             raise TarNotFound(f'The archive {archive} was not found!')
 
-        temp_dir = tempfile.mkdtemp()
-
         if use_sudo:
             run_fn = self.fake.run_sudo
         else:
             run_fn = self.fake.run_fake
 
-        # extract and rsync to avoid impact on ownership of base dir
-        run_fn(f'tar xf {tar_file.absolute()} -C {temp_dir}')
-        run_fn(f'rsync -a {temp_dir}/* {target_dir}')
-
-        run_fn(f'rm -rf {temp_dir}', check=False)
+        # extract in place, keep the metadata of existing directories
+        # to avoid impact on ownership of base dir
+        run_fn(f'tar xf {tar_file.absolute()} -C {target_dir} --no-overwrite-dir')
 
         return target_dir
 
@@ -381,9 +547,14 @@ class Files:
                 'Archive %s exists. Deleting old archive.', tmp_archive)
             fn_run(f'rm -f {tmp_archive}', check=False)
 
+        compress = ''
+        program = _tar_compress_program(archive_name)
+        if program:
+            compress = f'-I \'{program}\' '
+
         fn_run(
             'tar --exclude=\'./proc/*\' --exclude=\'./sys/*\' --exclude=\'./dev/*\' '
-            f'--exclude=\'./{archive_name}\' -cf {archive_name} .',
+            f'--exclude=\'./{archive_name}\' {compress}-cf {archive_name} .',
             target_dir
         )
 
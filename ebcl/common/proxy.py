@@ -1,16 +1,21 @@
 #!/usr/bin/env python
 """ EBcL apt proxy. """
+import collections
+import hashlib
 import logging
 import os
-import queue
 import shutil
 import tempfile
 
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from multiprocessing import get_context
 from typing import Optional, Tuple, Any
 from urllib.parse import urlparse
 
 import requests
 
+from requests.adapters import HTTPAdapter
+
 from .apt import Apt
 from .cache import Cache
 from .deb import Package, filter_packages
@@ -19,9 +24,21 @@ from .version import VersionDepends, VersionRelation
 from .types.cpu_arch import CpuArch
 
 
+def _extract_worker(package: Package, location: str) -> Optional[str]:
+    """ Extract a deb package in a worker process. """
+    return package.extract(location=location)
+
+
 class Proxy:
     """ EBcL apt proxy. """
 
+    # Files larger than this are downloaded using multiple connections.
+    RANGED_DOWNLOAD_THRESHOLD = 16 * 1024 * 1024
+    # Number of parallel connections for a ranged download.
+    RANGED_DOWNLOAD_PARTS = 4
+    # Number of parallel package downloads, 1 downloads sequentially.
+    DOWNLOAD_WORKERS = 8
+
     def __init__(
         self,
         apts: Optional[list[Apt]] = None,
@@ -31,29 +48,40 @@ class Proxy:
             self.apts: list[Apt] = []
         else:
             self.apts = apts
+        # Set of the apt repos for fast duplicate checks.
+        self._apt_set: set[Apt] = set(self.apts)
 
         if cache is None:
             self.cache: Cache = Cache()
         else:
             self.cache = cache
 
+        # Shared HTTP session, keeps the connections to the apt repos open.
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
     def add_apt(self, apt: Apt) -> bool:
         """ Adds an apt repo to the list of apt repos. """
-        if apt not in self.apts:
-            logging.info('Adding %s to proxy.', apt)
-            self.apts.append(apt)
-            return True
-        return False
+        if apt in self._apt_set:
+            return False
+
+        logging.info('Adding %s to proxy.', apt)
+        self._apt_set.add(apt)
+        self.apts.append(apt)
+        return True
 
     def remove_apt(self, apt: Apt) -> bool:
         """ Removes an apt repo to the list of apt repos. """
-        result = apt in self.apts
+        if apt not in self._apt_set:
+            return False
 
-        while apt in self.apts:
-            logging.info('Removing %s from proxy.', apt)
-            self.apts.remove(apt)
+        logging.info('Removing %s from proxy.', apt)
+        self._apt_set.discard(apt)
+        self.apts = [a for a in self.apts if a != apt]
 
-        return result
+        return True
 
     def find_package(self, vd: VersionDepends) -> Optional[Package]:
         """ Find package. """
@@ -152,6 +180,28 @@ class Proxy:
         if location is None:
             location = str(self.cache.folder)
 
+        p = self._cached_package(arch, package, version_relation, location)
+        if p:
+            return p
+
+        p = self._resolve_package_url(arch, package, version_relation)
+        if not p:
+            return None
+
+        p = self._fetch_package(p, location)
+        if not p:
+            return None
+
+        return self._add_to_cache(p, location)
+
+    def _cached_package(
+        self,
+        arch: CpuArch,
+        package: Package,
+        version_relation: VersionRelation,
+        location: str
+    ) -> Optional[Package]:
+        """ Get the package from the cache, if the file is available. """
         p = self._download_from_cache(
             VersionDepends(
                 name=package.name,
@@ -175,6 +225,15 @@ class Proxy:
         else:
             logging.debug('Package %s not found in cache.', package)
 
+        return None
+
+    def _resolve_package_url(
+        self,
+        arch: CpuArch,
+        package: Package,
+        version_relation: VersionRelation
+    ) -> Optional[Package]:
+        """ Get the package with a download URL. """
         if not package.file_url:
             # Find package URL.
             p = self.find_package(
@@ -196,137 +255,351 @@ class Proxy:
         if not package.file_url:
             return None
 
+        return package
+
+    def _fetch_package(self, package: Package, location: str) -> Optional[Package]:
+        """ Fetch the deb file of the package to location.
+
+        Doesn't touch the cache, so it can run in a worker thread.
+        """
+        assert package.file_url
+
         parsed_url = urlparse(package.file_url)
+        local_filename = os.path.join(location, os.path.basename(parsed_url.path))
+
         if parsed_url.scheme == "file":
             logging.info('Using package %s from %s...', package, parsed_url.path)
             package.local_file = parsed_url.path
             if location != self.cache.folder:
-                shutil.copy(package.local_file, location)
-        else:
-            # Download package.
-            logging.info('Downloading package %s from %s...', package, package.file_url)
+                shutil.copy(package.local_file, local_filename)
+            return package
+
+        # Download package.
+        logging.info('Downloading package %s from %s...', package, package.file_url)
+        try:
+            result = self._session.get(package.file_url, allow_redirects=True, timeout=10, stream=True)
+        except Exception as e:
+            logging.error('Downloading package %s of %s failed! %s', package, package.file_url, e)
+            return None
+
+        if result.status_code != requests.codes.ok:
+            logging.error("Download failed with status code %d: %s", result.status_code, result.reason)
+            return None
+
+        size = int(result.headers.get('Content-Length', 0))
+
+        digest: Optional[str] = None
+        stream: Optional[requests.Response] = result
+        if size > self.RANGED_DOWNLOAD_THRESHOLD and result.headers.get('Accept-Ranges') == 'bytes':
+            result.close()
+            stream = None
+            if self._download_ranged(package.file_url, local_filename, size):
+                if package.sha256:
+                    digest = self._file_sha256(local_filename)
+            else:
+                logging.warning('Ranged download of %s failed, retrying with a single connection.',
+                                package.file_url)
+                try:
+                    stream = self._session.get(package.file_url, allow_redirects=True, timeout=10, stream=True)
+                except Exception as e:
+                    logging.error('Downloading package %s of %s failed! %s', package, package.file_url, e)
+                    return None
+
+                if stream.status_code != requests.codes.ok:
+                    logging.error("Download failed with status code %d: %s",
+                                  stream.status_code, stream.reason)
+                    return None
+
+        if stream is not None:
             try:
-                result = requests.get(package.file_url, allow_redirects=True, timeout=10)
+                digest = self._download_stream(stream, local_filename, size)
             except Exception as e:
                 logging.error('Downloading package %s of %s failed! %s', package, package.file_url, e)
+                if os.path.isfile(local_filename):
+                    os.remove(local_filename)
                 return None
 
-            if result.status_code != requests.codes.ok:
-                logging.error("Download failed with status code %d: %s", result.status_code, result.reason)
-                return None
+        if package.sha256 and digest != package.sha256:
+            logging.error('Checksum of package %s from %s does not match! Expected %s, got %s.',
+                          package, package.file_url, package.sha256, digest)
+            os.remove(local_filename)
+            return None
 
-            local_filename = package.file_url.split('/')[-1]
-            local_filename = os.path.join(location, local_filename)
-            with open(local_filename, 'wb') as f:
-                for chunk in result.iter_content(chunk_size=512 * 1024):
-                    if chunk:  # filter out keep-alive new chunks
-                        f.write(chunk)
+        package.local_file = local_filename
+        return package
 
-            package.local_file = local_filename
+    def _add_to_cache(self, package: Package, location: str) -> Package:
+        """ Add a downloaded package to the cache. """
+        assert package.file_url
 
-            if location == self.cache.folder:
-                # Add package to cache
-                logging.debug('Adding package %s to cache.', package)
-                package.local_file = self.cache.add(package, True)
-            else:
-                logging.info('Download folder is not cache folder. Copying %s to cache.', package)
-                package.local_file = self.cache.add(package)
+        if urlparse(package.file_url).scheme == "file":
+            # Local packages are not cached.
+            return package
+
+        if location == self.cache.folder:
+            # Add package to cache
+            logging.debug('Adding package %s to cache.', package)
+            package.local_file = self.cache.add(package, True)
+        else:
+            logging.info('Download folder is not cache folder. Copying %s to cache.', package)
+            package.local_file = self.cache.add(package)
 
         return package
 
+    @staticmethod
+    def _preallocate(fd: int, size: int) -> None:
+        """ Allocate the file in one go to avoid fragmentation. """
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError) as e:
+            logging.debug('Preallocation of %d bytes failed! %s', size, e)
+
+    def _download_stream(self, result: requests.Response, local_filename: str, size: int) -> str:
+        """ Write a streamed download to local_filename and return its SHA256 checksum. """
+        sha256 = hashlib.sha256()
+
+        with open(local_filename, 'wb') as f:
+            if size:
+                self._preallocate(f.fileno(), size)
+
+            for chunk in result.iter_content(chunk_size=512 * 1024):
+                if chunk:  # filter out keep-alive new chunks
+                    sha256.update(chunk)
+                    f.write(chunk)
+
+            # Drop preallocated space not covered by the download.
+            f.truncate()
+
+        return sha256.hexdigest()
+
+    def _download_ranged(self, url: str, local_filename: str, size: int) -> bool:
+        """ Download a file using parallel HTTP range requests. """
+        part_size = -(-size // self.RANGED_DOWNLOAD_PARTS)
+        ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+        logging.debug('Downloading %s in %d parts.', url, len(ranges))
+
+        fd = os.open(local_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+        def download_range(start: int, end: int) -> None:
+            result = self._session.get(
+                url, headers={'Range': f'bytes={start}-{end}'},
+                allow_redirects=True, timeout=10, stream=True)
+
+            if result.status_code != requests.codes.partial_content:
+                raise IOError(f'Range request failed with status code {result.status_code}: {result.reason}')
+
+            offset = start
+            for chunk in result.iter_content(chunk_size=512 * 1024):
+                if chunk:  # filter out keep-alive new chunks
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+
+            if offset != end + 1:
+                raise IOError(f'Range {start}-{end} is incomplete, got {offset - start} bytes.')
+
+        try:
+            self._preallocate(fd, size)
+
+            with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+                futures = [pool.submit(download_range, start, end) for (start, end) in ranges]
+                for future in futures:
+                    future.result()
+        except Exception as e:
+            logging.error('Ranged download of %s failed! %s', url, e)
+            os.remove(local_filename)
+            return False
+        finally:
+            os.close(fd)
+
+        return True
+
+    @staticmethod
+    def _file_sha256(file: str) -> str:
+        """ Get the SHA256 checksum of a file. """
+        sha256 = hashlib.sha256()
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
     def download_deb_packages(
         self,
         packages: list[VersionDepends],
         extract: bool = True,
         debs: Optional[str] = None,
         contents: Optional[str] = None,
-        download_depends: bool = True
+        download_depends: bool = True,
+        workdir: Optional[str] = None,
+        skip_extracted: bool = False
     ) -> Tuple[str, Optional[str], list[str]]:
-        """ Download and optionally extract the given packages and its depends. """
+        """ Download and optionally extract the given packages and its depends.
+
+        If workdir is given, the debs and contents folders default to stable
+        sub-folders of workdir instead of new temporary folders. The caller
+        is responsible for removing the workdir.
+
+        If skip_extracted is set, debs already extracted to contents by a
+        previous call are not extracted again. The extracted debs are recorded
+        as stamp files in contents/.extracted.
+        """
         # Queue for package download.
-        pq: queue.Queue[list[VersionDepends]] = queue.Queue(maxsize=-1)
-        # Registry of available packages.
-        local_packages: dict[str, str] = {}
+        pq: collections.deque[VersionDepends] = collections.deque()
+        # Names of all packages added to the queue.
+        queued: set[str] = set()
         # List of not found packages
         missing: list[str] = []
+        # Running package extractions
+        extractions: dict[Future[Optional[str]], str] = {}
+        # Stamp files of the running extractions
+        stamps: dict[Future[Optional[str]], str] = {}
+        # Available debs by resolution index, waiting for the previous ones
+        available: dict[int, tuple[Optional[Package], str]] = {}
+        # Number of resolved packages, and of the processed ones
+        resolved = 0
+        processed = 0
 
         # Folder for debs
         if debs is None:
-            debs = tempfile.mkdtemp()
-            logging.debug('Downloading to temp folder %s.', debs)
+            if workdir:
+                debs = os.path.join(workdir, 'debs')
+                os.makedirs(debs, exist_ok=True)
+            else:
+                debs = tempfile.mkdtemp()
+            logging.debug('Downloading to folder %s.', debs)
 
         # Folder for package content
         if extract:
             if contents is None:
-                contents = tempfile.mkdtemp()
+                if workdir:
+                    contents = os.path.join(workdir, 'contents')
+                    os.makedirs(contents, exist_ok=True)
+                else:
+                    contents = tempfile.mkdtemp()
             logging.debug('Extracting to folder %s.', contents)
 
         for vd in packages:
+            if vd.name in queued:
+                continue
             # Adding packages to download queue.
             logging.info('Adding package %s to queue.', vd)
-            pq.put_nowait([vd])
-
-        while not pq.empty():
-            vds = pq.get_nowait()
-            if not vds:
-                # handle empty list
-                continue
-
-            # TODO: handle alternatives
-            # use always first alternative only
-            vd = vds[0]
-
-            name = vd.name
-
-            if name in local_packages:
-                continue
-
-            package = self.find_package(vd)
-
-            if package is None:
-                logging.error('The package %s was not found!', name)
-                missing.append(name)
-                continue
-
-            if not package.local_file:
-                package = self.download_package(
-                    arch=vd.arch,
-                    package=package,
-                    version_relation=vd.version_relation,
-                    location=debs)
-
+            queued.add(vd.name)
+            pq.append(vd)
+
+        def deb_available(package: Optional[Package], name: str, index: int) -> None:
+            """ Take over the debs in resolution order. """
+            nonlocal processed
+            available[index] = (package, name)
+            while processed in available:
+                process_deb(*available.pop(processed))
+                processed += 1
+
+        def process_deb(package: Optional[Package], name: str) -> None:
+            """ Take over a downloaded deb and extract it. """
             if not package or \
                     not package.local_file or \
                     not os.path.isfile(package.local_file):
                 logging.error('Download of %s failed!', name)
                 missing.append(name)
-                continue
+                return
 
             if debs != os.path.dirname(package.local_file):
                 shutil.copy(package.local_file, debs)
 
             if extract:
-                package.extract(location=contents)
+                assert contents
+
+                stamp = None
+                if skip_extracted:
+                    digest = package.sha256 or self._file_sha256(package.local_file)
+                    stamp = os.path.join(contents, '.extracted', f'{digest}.stamp')
+                    if os.path.isfile(stamp):
+                        logging.info('Package %s is already extracted.', name)
+                        return
+
+                future = extract_pool.submit(_extract_worker, package, contents)
+                extractions[future] = name
+                if stamp:
+                    stamps[future] = stamp
 
-            local_packages[name] = package.local_file
             logging.debug('Deb file: %s', package.local_file)
 
-            if not download_depends:
-                continue
+        # The package transfers run in parallel, the lookups and the cache
+        # are only used by this thread. A single worker process extracts the
+        # debs in resolution order, so files of later packages replace files
+        # of earlier ones deterministically. The worker is started by a fork
+        # server, since forking this process while threads run can deadlock.
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('forkserver')) as extract_pool, \
+                ThreadPoolExecutor(max_workers=self.DOWNLOAD_WORKERS) as pool:
+            downloads: dict[Future[Optional[Package]], tuple[str, int]] = {}
+
+            while pq:
+                vd = pq.popleft()
+                name = vd.name
+
+                package = self.find_package(vd)
 
-            # Add deps to queue
-            for vds in package.get_depends():
-                if not vds:
+                if package is None:
+                    logging.error('The package %s was not found!', name)
+                    missing.append(name)
                     continue
 
-                # TODO: handle alternatives
-                vd = vds[0]
+                index = resolved
+                resolved += 1
 
-                name = vd.name
-                if name not in local_packages:
-                    logging.info(
-                        'Adding dependency %s to download queue. Queue size: %d', vd, pq.qsize())
-                    pq.put_nowait([vd])
+                if package.local_file:
+                    deb_available(package, name, index)
+                else:
+                    version_relation = vd.version_relation or VersionRelation.EXACT
+                    p = self._cached_package(vd.arch, package, version_relation, debs)
+                    if not p:
+                        p = self._resolve_package_url(vd.arch, package, version_relation)
+                    if p and not p.local_file:
+                        downloads[pool.submit(self._fetch_package, p, debs)] = (name, index)
+                    else:
+                        deb_available(p, name, index)
+
+                if not download_depends:
+                    continue
+
+                # Add deps to queue
+                for vds in package.get_depends():
+                    if not vds:
+                        continue
+
+                    # TODO: handle alternatives
+                    vd = vds[0]
+
+                    if vd.name not in queued:
+                        logging.info(
+                            'Adding dependency %s to download queue. Queue size: %d', vd, len(pq))
+                        queued.add(vd.name)
+                        pq.append(vd)
+
+            for future in as_completed(downloads):
+                (name, index) = downloads[future]
+                try:
+                    p = future.result()
+                except Exception as e:
+                    logging.error('Download of %s failed! %s', name, e)
+                    p = None
+                if p:
+                    p = self._add_to_cache(p, debs)
+                deb_available(p, name, index)
+
+        wait(extractions)
+        for future, name in extractions.items():
+            try:
+                if future.result() is None:
+                    logging.error('Extraction of %s failed!', name)
+                    missing.append(name)
+                elif future in stamps:
+                    os.makedirs(os.path.dirname(stamps[future]), exist_ok=True)
+                    with open(stamps[future], 'w', encoding='utf-8'):
+                        pass
+            except Exception as e:
+                logging.error('Extraction of %s failed! %s', name, e)
+                missing.append(name)
 
         return (debs, contents, missing)
 
@@ -19,13 +19,11 @@ class BuildType(Enum):
         if isinstance(build_type, cls):
             return build_type
 
-        elif build_type == 'kiwi':
-            return cls.KIWI
-        elif build_type == 'debootstrap':
-            return cls.DEBOOTSTRAP
-        else:
+        if not isinstance(build_type, str):
             return None
 
+        return _BUILD_TYPE_NAMES.get(build_type, None)
+
     def __str__(self) -> str:
         if self.value == 2:
             return "kiwi-ng"
@@ -33,3 +31,10 @@ class BuildType(Enum):
             return "debootstrap"
         else:
             return "UNKNOWN"
+
+
+# Lookup table for BuildType.from_str.
+_BUILD_TYPE_NAMES: dict[str, BuildType] = {
+    'kiwi': BuildType.KIWI,
+    'debootstrap': BuildType.DEBOOTSTRAP,
+}
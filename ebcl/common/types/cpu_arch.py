@@ -27,19 +27,11 @@ class CpuArch(Enum):
         if isinstance(arch, cls):
             return arch
 
-        if arch == 'amd64':
-            return cls.AMD64
-        elif arch == 'arm64':
-            return cls.ARM64
-        elif arch == 'armhf':
-            return cls.ARMHF
-        elif arch == 'any':
-            return cls.ANY
-        elif arch == 'all':
-            return cls.ALL
-        else:
+        if not isinstance(arch, str):
             return None
 
+        return _CPU_ARCH_NAMES.get(arch, None)
+
     def __str__(self) -> str:
         if self == self.AMD64:
             return "amd64"
@@ -83,3 +75,13 @@ class CpuArch(Enum):
 
         raise UnsupportedCpuArchitecture(
             f'Unsupported CPU architecture {str(self)} for berrymill build!')
+
+
+# Lookup table for CpuArch.from_str.
+_CPU_ARCH_NAMES: dict[str, CpuArch] = {
+    'amd64': CpuArch.AMD64,
+    'arm64': CpuArch.ARM64,
+    'armhf': CpuArch.ARMHF,
+    'any': CpuArch.ANY,
+    'all': CpuArch.ALL,
+}
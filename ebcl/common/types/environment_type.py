@@ -21,17 +21,11 @@ class EnvironmentType(Enum):
         if isinstance(script_type, cls):
             return script_type
 
-        if script_type == 'fake':
-            return cls.FAKEROOT
-        elif script_type == 'chroot':
-            return cls.CHROOT
-        elif script_type == 'sudo':
-            return cls.SUDO
-        elif script_type == 'shell':
-            return cls.SHELL
-        else:
+        if not isinstance(script_type, str):
             return None
 
+        return _ENVIRONMENT_TYPE_NAMES.get(script_type, None)
+
     def __str__(self) -> str:
         if self.value == 1:
             return "fake"
@@ -43,3 +37,12 @@ class EnvironmentType(Enum):
             return "shell"
         else:
             return "UNKNOWN"
+
+
+# Lookup table for EnvironmentType.from_str.
+_ENVIRONMENT_TYPE_NAMES: dict[str, EnvironmentType] = {
+    'fake': EnvironmentType.FAKEROOT,
+    'chroot': EnvironmentType.CHROOT,
+    'sudo': EnvironmentType.SUDO,
+    'shell': EnvironmentType.SHELL,
+}
@@ -3,6 +3,7 @@ from __future__ import annotations
 
 import logging
 import re
+import sys
 
 from dataclasses import dataclass
 from enum import Enum
@@ -10,6 +11,9 @@ from typing import Optional
 
 from .types.cpu_arch import CpuArch
 
+# Splits a version into numeric and non-numeric parts.
+_PARTS_RE = re.compile(r'\d+|\D+')
+
 
 class Version:
     """ Debian package version. """
@@ -77,8 +81,8 @@ class Version:
 
     def _lt_parts(self, a: str, b: str) -> bool:
         # split to parts
-        a_parts = re.findall(r'\d+|\D+', a)
-        b_parts = re.findall(r'\d+|\D+', b)
+        a_parts = _PARTS_RE.findall(a)
+        b_parts = _PARTS_RE.findall(b)
 
         # align length
         while len(a_parts) < len(b_parts):
@@ -177,18 +181,7 @@ class VersionRelation(Enum):
     @classmethod
     def from_str(cls, relation: str) -> VersionRelation | None:
         """ Get ImageType from str. """
-        if relation == '<<':
-            return cls.STRICT_SMALLER
-        elif relation == '<=':
-            return cls.SMALLER
-        elif relation == '=':
-            return cls.EXACT
-        elif relation == '>=':
-            return cls.LARGER
-        elif relation == '>>':
-            return cls.STRICT_LARGER
-        else:
-            return None
+        return _VERSION_RELATION_NAMES.get(relation, None)
 
     def __str__(self) -> str:
         if self.value == 1:
@@ -208,6 +201,16 @@ class VersionRelation(Enum):
         return self.__str__()
 
 
+# Lookup table for VersionRelation.from_str.
+_VERSION_RELATION_NAMES: dict[str, VersionRelation] = {
+    '<<': VersionRelation.STRICT_SMALLER,
+    '<=': VersionRelation.SMALLER,
+    '=': VersionRelation.EXACT,
+    '>=': VersionRelation.LARGER,
+    '>>': VersionRelation.STRICT_LARGER,
+}
+
+
 class PackageRelation(Enum):
     """ Debian package relation. """
     UNDEFINED = 0
@@ -239,7 +242,7 @@ class PackageRelation(Enum):
         return self.__str__()
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class VersionDepends:
     """ Debian package version dependency. """
     name: str
@@ -273,6 +276,9 @@ class VersionDepends:
             self.version_relation == value.version_relation and \
             self.arch == value.arch
 
+    def __hash__(self) -> int:
+        return hash((self.name, self.package_relation, self.version_relation, self.arch))
+
     def __lt__(self, other: object) -> bool:
         if not isinstance(other, VersionDepends):
             return False
@@ -339,7 +345,7 @@ def parse_depends(
                 version_relation = VersionRelation.EXACT
 
         vd = VersionDepends(
-            name,
+            sys.intern(name),
             package_relation,
             version_relation,
             version,
@@ -50,21 +50,8 @@ class BootGenerator:
         if missing:
             logging.critical('Not found packages: %s', missing)
 
-    @log_exception()
-    def create_boot(self) -> Optional[str]:
-        """ Create the boot.tar.  """
-        logging.debug('Target directory: %s', self.config.target_dir)
-
-        package_dir = tempfile.mkdtemp()
-        logging.debug('Package directory: %s', package_dir)
-
-        output_path = os.path.abspath(self.config.output_path)
-        logging.debug('Output directory: %s', self.config.output_path)
-        if not os.path.isdir(self.config.output_path):
-            logging.critical('Output path %s is no folder!',
-                             self.config.output_path)
-            exit(1)
-
+    def _fill_target_dir(self, package_dir: str) -> None:
+        """ Collect the boot files from package_dir in the target dir. """
         logging.info('Download deb packages...')
         self.download_deb_packages(package_dir)
 
@@ -72,36 +59,26 @@ class BootGenerator:
             base_tarball = self.config.base_tarball
 
             logging.info('Extracting base tarball %s...', base_tarball)
-            boot_tar_temp = tempfile.mkdtemp()
 
-            logging.debug('Extracting bsae tarball %s to %s',
-                          base_tarball, boot_tar_temp)
+            # Merge deb content and boot tarball.
+            # extract_tarball already merges the tarball content into the
+            # given directory, no additional copy is needed.
+            logging.debug('Extracting base tarball %s to %s',
+                          base_tarball, package_dir)
 
             self.fh.extract_tarball(
                 archive=base_tarball,
-                directory=boot_tar_temp,
+                directory=package_dir,
                 use_sudo=not self.config.use_fakeroot
             )
 
-            if self.config.use_fakeroot:
-                run_fn = self.fake.run_fake
-            else:
-                run_fn = self.fake.run_sudo
-
-            # Merge deb content and boot tarball
-            run_fn(cmd=f'rsync -a {boot_tar_temp}/* {package_dir}')
-
-            # Delete temporary tar folder
-            run_fn(f'rm -rf {boot_tar_temp}', check=False)
-
-        # Copy host files to target_dir folder
-        logging.info('Copy host files to target dir...')
-        self.fh.copy_files(self.config.host_files,
-                           self.config.target_dir)
-
         # Copy host files package_dir folder
         logging.info('Copy host files package dir...')
-        self.fh.copy_files(self.config.host_files, package_dir)
+        host_files = self.fh.copy_files(self.config.host_files, package_dir)
+
+        # Clone the copied host files to target_dir folder
+        logging.info('Copy host files to target dir...')
+        self.fh.clone_files(host_files, package_dir, self.config.target_dir)
 
         logging.info('Running config scripts...')
         self.fh.run_scripts(self.config.scripts, package_dir)
@@ -113,9 +90,33 @@ class BootGenerator:
         self.fh.copy_files(files, self.config.target_dir,
                            fix_ownership=True)
 
-        # Remove package temporary folder
-        logging.info('Remove temporary package contents...')
-        self.fake.run_sudo(f'rm -rf {package_dir}', check=False)
+    def _remove_package_dir(self, package_dir: str) -> None:
+        """ Remove the package dir, which contains root owned files. """
+        try:
+            self.fake.run_sudo(f'rm -rf {package_dir}')
+        except Exception as e:
+            logging.warning('Removing %s using sudo failed! %s', package_dir, e)
+            shutil.rmtree(package_dir, ignore_errors=True)
+
+    @log_exception()
+    def create_boot(self) -> Optional[str]:
+        """ Create the boot.tar.  """
+        logging.debug('Target directory: %s', self.config.target_dir)
+
+        output_path = os.path.abspath(self.config.output_path)
+        logging.debug('Output directory: %s', output_path)
+        if not os.path.isdir(output_path):
+            logging.critical('Output path %s is no folder!', output_path)
+            exit(1)
+
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as package_dir:
+            logging.debug('Package directory: %s', package_dir)
+            try:
+                self._fill_target_dir(package_dir)
+            finally:
+                # Remove package temporary folder
+                logging.info('Remove temporary package contents...')
+                self._remove_package_dir(package_dir)
 
         if self.config.tar:
             # create tar archive
@@ -130,15 +131,13 @@ class BootGenerator:
 
         # copy to output folder
         logging.info('Copying files...')
-        self.fh.copy_file(f'{self.config.target_dir}/*',
-                          output_path,
-                          move=True,
-                          delete_if_exists=True,
-                          fix_ownership=True)
+        self.fh.move_dir_contents(self.config.target_dir,
+                                  output_path,
+                                  fix_ownership=True)
         return output_path
 
     @log_exception()
-    def finalize(self):
+    def finalize(self) -> None:
         """ Finalize output and cleanup. """
 
         # delete temporary folder
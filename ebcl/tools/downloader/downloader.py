@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 """ Download and extract deb packages. """
 import argparse
+import functools
 import logging
 import os
 import tempfile
@@ -14,6 +15,18 @@ from ebcl.common.version import VersionDepends
 from ebcl.common.types.cpu_arch import CpuArch
 
 
+@functools.lru_cache(maxsize=1024)
+def _make_vd(name: str, arch: CpuArch) -> VersionDepends:
+    """ Get the VersionDepends for the given package name. """
+    return VersionDepends(
+        name=name,
+        package_relation=None,
+        version_relation=None,
+        version=None,
+        arch=arch
+    )
+
+
 class PackageDownloader:
     """ Download and extract deb packages. """
     # TODO: test
@@ -49,26 +62,23 @@ class PackageDownloader:
         content_path = os.path.join(output_path, 'contents')
         os.makedirs(content_path, exist_ok=True)
 
-        package_names = [p.strip() for p in packages.split(' ')]
+        # Split on any whitespace and drop duplicates, keeping the order.
+        package_names = list(dict.fromkeys(packages.split()))
 
         if not package_names:
             logging.error('No package names given.')
             exit(1)
 
-        vds: list[VersionDepends] = [VersionDepends(
-            name=name,
-            package_relation=None,
-            version_relation=None,
-            version=None,
-            arch=cpu_arch
-        ) for name in package_names]
+        vds: list[VersionDepends] = [_make_vd(name, cpu_arch)
+                                     for name in package_names]
 
         (_debs, _contents, missing) = self.config.proxy.download_deb_packages(
             packages=vds,
             extract=True,
             debs=output_path,
             contents=content_path,
-            download_depends=download_depends
+            download_depends=download_depends,
+            skip_extracted=True
         )
 
         if missing:
@@ -1,44 +1,125 @@
 import argparse
+import collections
+import hashlib
+import json
 import logging
 import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import jinja2
 import yaml
 
-from ebcl.common import init_logging, log_exception
+try:
+    # Use the libyaml based loader if PyYAML was built with libyaml support.
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader  # type: ignore[assignment]
+
+from ebcl.common import get_cache_folder, get_private_cache_folder, init_logging, log_exception
 from ebcl.common.files import resolve_file
 
+from .model_gen import ConfigError
 from .schema_loader import BaseModel, FileReadProtocol, Schema, merge_dict
 
+# Parsed yaml files by (realpath, mtime_ns, size).
+_YAML_CACHE: dict[tuple[str, int, int], dict] = {}
+
+# Shared template environment and compiled templates by source.
+_JINJA_ENV = jinja2.Environment(trim_blocks=True)
+_TEMPLATE_CACHE: dict[str, jinja2.Template] = {}
+
 
 class BaseResolver:
     """
     Resolve bases defined in the yaml config.
     """
 
+    def __init__(self) -> None:
+        # (mtime_ns, size) of all files loaded for the current config.
+        self._opened: dict[str, tuple[int, int]] = {}
+
     def load(self, config_file: str, conf_dir: str) -> dict:
         """
         Load config_file and all of its bases.
+
+        If EBCL_YAML_CACHE=1 is set, the resolved config is cached as JSON
+        and reused as long as none of the loaded files changed.
         """
-        config = {
-            "base": [config_file]
-        }
-        while config["base"]:
-            base_name = config["base"].pop(0)
+        cache_file = None
+        if os.getenv("EBCL_YAML_CACHE") == "1":
+            path = os.path.abspath(resolve_file(file=config_file, relative_base_dir=conf_dir))
+            key = hashlib.sha1(path.encode("utf-8")).hexdigest()
+            cache_file = os.path.join(get_cache_folder("hypervisor"), f"{key}.resolved.json")
+            cached = self._load_cache(cache_file)
+            if cached is not None:
+                return cached
+
+        self._opened = {}
+        config: dict = {}
+        pending = collections.deque([config_file])
+        while pending:
+            base_name = pending.popleft()
             base_path = resolve_file(
                 file=base_name, relative_base_dir=conf_dir)
             old = config
             config = self._load_file(base_path)
+            bases = config.pop("base", [])
+            if not isinstance(bases, list):
+                raise ConfigError(f"Invalid base in {base_path}, a list is expected")
+            # The bases of a file are loaded before the remaining bases of the
+            # files including it.
+            pending.extendleft(reversed(bases))
             merge_dict(config, old)
+
+        if cache_file:
+            self._store_cache(cache_file, config)
+
         return config
 
+    def _load_cache(self, cache_file: str) -> dict | None:
+        """ Get the cached config if all files of its manifest are unchanged. """
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            for path, (mtime_ns, size) in cache["manifest"].items():
+                st = os.stat(path)
+                if st.st_mtime_ns != mtime_ns or st.st_size != size:
+                    return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        logging.debug("Using cached config %s.", cache_file)
+        return cache["config"]
+
+    def _store_cache(self, cache_file: str, config: dict) -> None:
+        """ Store the resolved config and the state of the loaded files. """
+        try:
+            data = json.dumps({"manifest": self._opened, "config": config})
+            # Only cache configs which survive the JSON round trip unchanged.
+            if json.loads(data)["config"] != config:
+                return
+            tmp_file = f"{cache_file}.{os.getpid()}"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_file, cache_file)
+        except Exception as e:
+            logging.debug("Caching config %s failed! %s", cache_file, e)
+
     def _load_file(self, filename: str) -> dict:
-        with open(filename, "r", encoding="utf-8") as f:
-            data = yaml.load(f, yaml.Loader)
-            if not data:
-                data = {}
-            return data
+        st = os.stat(filename)
+        key = (os.path.realpath(filename), st.st_mtime_ns, st.st_size)
+        self._opened[key[0]] = (st.st_mtime_ns, st.st_size)
+        data = _YAML_CACHE.get(key)
+        if data is None:
+            with open(filename, "r", encoding="utf-8") as f:
+                data = yaml.load(f, SafeLoader)
+                if not data:
+                    data = {}
+            _YAML_CACHE[key] = data
+        # merge_dict and load only modify the top level dict.
+        return dict(data)
 
 
 class HvFileGenerator:
@@ -60,17 +141,71 @@ class HvFileGenerator:
         config_file = Path(file)
 
         config = BaseResolver().load(config_file.name, str(config_file.parent))
-        del config["base"]
 
-        self.schema = Schema(specialization and Path(specialization) or None)
-        self.config = self.schema.parse_config(config)
+        self.schema = Schema.get(specialization and Path(specialization) or None)
+        self.config = self._parse_config(config)
+
+    def _parse_config(self, config: dict) -> BaseModel:
+        """
+        Parse the config with the schema.
+
+        If EBCL_YAML_CACHE=1 is set, the parsed model is cached for the
+        config and schema in a folder private to the user. Schemas using
+        an extension model or generated classes are not cached.
+        """
+        cache_key = self.schema.cache_key
+        if os.getenv("EBCL_YAML_CACHE") != "1" or not cache_key:
+            return self.schema.parse_config(config)
+
+        try:
+            data = json.dumps(config, sort_keys=True)
+        except (TypeError, ValueError):
+            return self.schema.parse_config(config)
+
+        cache_folder = get_private_cache_folder(get_cache_folder("hypervisor"), "models")
+        if not cache_folder:
+            return self.schema.parse_config(config)
+
+        key = hashlib.sha256(f"{cache_key}{data}".encode("utf-8")).hexdigest()
+        cache_file = os.path.join(cache_folder, f"{key}.model.pkl")
+
+        try:
+            with open(cache_file, "rb") as f:
+                logging.debug("Using cached model %s.", cache_file)
+                return pickle.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.debug("Reading cached model %s failed! %s", cache_file, e)
+
+        parsed = self.schema.parse_config(config)
+
+        tmp_file = f"{cache_file}.{os.getpid()}"
+        try:
+            with open(tmp_file, "wb") as f:
+                pickle.dump(parsed, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except Exception as e:
+            # e.g. models using classes generated from the schema
+            logging.debug("Caching model %s failed! %s", cache_file, e)
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+        return parsed
 
     def _render_template(self, outpath: Path, template: FileReadProtocol) -> None:
         """Render a template to target"""
-        template_obj = jinja2.Template(template.read_text("utf-8"), trim_blocks=True)
+        source = template.read_text("utf-8")
+        template_obj = _TEMPLATE_CACHE.get(source)
+        if template_obj is None:
+            template_obj = _JINJA_ENV.from_string(source)
+            _TEMPLATE_CACHE[source] = template_obj
 
         with outpath.open("w", encoding="utf-8") as f:
-            f.write(template_obj.render(config=self.config))
+            stream = template_obj.stream(config=self.config)
+            # Coalesce the many small template chunks into fewer writes.
+            stream.enable_buffering(size=64)
+            stream.dump(f)
 
     def create_files(self) -> None:
         """
@@ -79,16 +214,26 @@ class HvFileGenerator:
         """
         self.output_path.mkdir(exist_ok=True)
 
-        for template in self.schema.templates:
-            base, ext = os.path.splitext(template.name)
-            if ext == ".j2":
-                logging.info("Rendering %s", base)
-                outpath = self.output_path / base
-                self._render_template(outpath, template)
-            else:
-                logging.info("Creating %s", template)
-                outpath = self.output_path / template.name
-                outpath.write_text(template.read_text("utf-8"))
+        templates = self.schema.templates
+        if not templates:
+            return
+
+        # The files are independent and the config is only read.
+        with ThreadPoolExecutor(max_workers=min(8, len(templates))) as pool:
+            list(pool.map(self._create_file, templates))
+
+    def _create_file(self, template: FileReadProtocol) -> None:
+        """Render the template or copy the file to the output path"""
+        base, ext = os.path.splitext(template.name)
+        if ext == ".j2":
+            logging.info("Rendering %s", base)
+            outpath = self.output_path / base
+            self._render_template(outpath, template)
+        else:
+            logging.info("Creating %s", template)
+            outpath = self.output_path / template.name
+            # Copy the bytes, no decoding and encoding needed.
+            outpath.write_bytes(template.read_bytes())
 
 
 @log_exception(call_exit=True)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Literal
+from typing import Iterable, Literal
 
 from .model_gen import BaseModel, ConfigError
 
@@ -9,6 +9,7 @@ class VNet:
     """
     Represents a virtual network interface pair
     """
+    __slots__ = ("name", "users")
 
     name: str
     """Name of the net to identify it in the device tree and the configuration"""
@@ -37,6 +38,7 @@ class VNetRef:
     """
     Reference to one side of a virtual network interface pair
     """
+    __slots__ = ("vnet", "site_a")
 
     vnet: VNet
     """Link to the vnet"""
@@ -48,6 +50,9 @@ class VNetRef:
         self.site_a = site_a
 
     def __getattr__(self, attr: str):
+        if attr == "vnet":
+            # Not set yet, e.g. while unpickling
+            raise AttributeError(attr)
         return getattr(self.vnet, attr)
 
     def __repr__(self) -> str:
@@ -60,16 +65,19 @@ class VirtioBlock:
     The server interface is a console interfaces that has to be served by vio_filed
     The client interface is a standard virtio block interface.
     """
+    __slots__ = ("name", "server", "client")
 
     name: str
     """Name used for identification in the configuration and device tree"""
-    server: VM | None = None
+    server: VM | None
     """Server VM"""
-    client: VM | None = None
+    client: VM | None
     """Client VM"""
 
     def __init__(self, name) -> None:
         self.name = name
+        self.server = None
+        self.client = None
 
     def __repr__(self) -> str:
         return f"VirtioBlock({self.name})"
@@ -79,6 +87,8 @@ class VirtioBlockRef:
     """
     A reference to the client or server side of a virtio block interface
     """
+    __slots__ = ("vio", "is_server")
+
     vio: VirtioBlock
     """Link to the virtio block description"""
     is_server: bool
@@ -89,6 +99,9 @@ class VirtioBlockRef:
         self.is_server = is_server
 
     def __getattr__(self, attr: str):
+        if attr == "vio":
+            # Not set yet, e.g. while unpickling
+            raise AttributeError(attr)
         return getattr(self.vio, attr)
 
     def __repr__(self) -> str:
@@ -183,12 +196,20 @@ class SHM(BaseModel):
     address: int | None
     """Fixed start address of the region, if required"""
 
+    @property
+    def sort_key(self) -> tuple[bool, int]:
+        """
+        Key for sorting shared memory segments, segments with a specified
+        address come first in ascending order
+        """
+        return (self.address is None, self.address or 0)
+
     def __lt__(self, other: SHM) -> bool:
         """
         Ensure that shared memory segments with a specified address
         are allocated first in ascending order
         """
-        return (self.address and True or False) and (not other.address or self.address < other.address)
+        return self.sort_key < other.sort_key
 
     def __repr__(self) -> str:
         return f"SHM({self.name})"
@@ -237,10 +258,10 @@ class VM(BaseModel):
     virtio_block: list[VirtioBlockNode] | list[VirtioBlockRef]
 
     def finalize(self, registry: HVConfig) -> None:
-        registry.register_module(self.kernel)
-        registry.register_module(self.dtb)
         if self.initrd:
-            registry.register_module(self.initrd)
+            registry.register_modules((self.kernel, self.dtb, self.initrd))
+        else:
+            registry.register_modules((self.kernel, self.dtb))
 
         if isinstance(self.vbus, str):
             vbus_name = self.vbus
@@ -253,18 +274,14 @@ class VM(BaseModel):
             raise ConfigError(
                 f"VM {self.name}: The following shared memory segments are not defined: {value}"
             )
-        self.vnets = list(
-            map(lambda x: registry.register_vnet(x, self), self.vnets)  # type: ignore
-        )
+        self.vnets = [registry.register_vnet(x, self) for x in self.vnets]  # type: ignore
 
         if self.virtio_block:
-            server = map(
-                lambda x: registry.register_virtio_block(x, self, True), self.virtio_block.servers  # type: ignore
-            )
-            clients = map(
-                lambda x: registry.register_virtio_block(x, self, False), self.virtio_block.clients  # type: ignore
-            )
-            self.virtio_block = list(server) + list(clients)  # type: ignore
+            self.virtio_block = [
+                registry.register_virtio_block(x, self, True) for x in self.virtio_block.servers  # type: ignore
+            ] + [
+                registry.register_virtio_block(x, self, False) for x in self.virtio_block.clients  # type: ignore
+            ]
         else:
             self.virtio_block = []
 
@@ -296,13 +313,11 @@ class HVConfig(BaseModel):
         Register a virtual network link user.
         The vnet is matched by the name and if it does not exist yet it will be created.
         """
-        for net in self.vnets:
-            if net.name == name:
-                vnet = net
-                break
-        else:
+        vnet = self._vnet_by_name.get(name)
+        if vnet is None:
             vnet = VNet(name)
             self.vnets.append(vnet)
+            self._vnet_by_name[name] = vnet
         vnet.add_user(user)
         return VNetRef(vnet, len(vnet.users) == 1)
 
@@ -311,13 +326,11 @@ class HVConfig(BaseModel):
         Register a virtio block interface user.
         The interface is matched by name and if it does not exist yet it will be created.
         """
-        for cur in self.vio_block:
-            if cur.name == name:
-                vio = cur
-                break
-        else:
+        vio = self._vio_by_name.get(name)
+        if vio is None:
             vio = VirtioBlock(name)
             self.vio_block.append(vio)
+            self._vio_by_name[name] = vio
         if is_server:
             if vio.server:
                 raise ConfigError(f"VM {user.name}: Server for Virtio Block {name} already set to {vio.server.name}")
@@ -332,17 +345,22 @@ class HVConfig(BaseModel):
         """
         Returns an existing virtual bus with the given name
         """
-        for vbus in self.vbus:
-            if vbus.name == name:
-                return vbus
-        return None
+        return self._vbus_by_name.get(name)
 
     def get_shms(self, names: list[str]) -> tuple[list[SHM], set[str]]:
         """
         Returns all registered shared memories matched by names
         """
-        out = list(filter(lambda x: x.name in names, self.shms))
-        return out, set(names) - set([out.name for out in out])
+        found: set[int] = set()
+        missing: set[str] = set()
+        for name in names:
+            index = self._shm_index.get(name)
+            if index is None:
+                missing.add(name)
+            else:
+                found.add(index)
+        # Keep the order of the registered shared memories.
+        return [self.shms[i] for i in sorted(found)], missing
 
     def register_module(self, name: str) -> None:
         """
@@ -350,12 +368,31 @@ class HVConfig(BaseModel):
         """
         self.modules.add(name)
 
+    def register_modules(self, names: Iterable[str]) -> None:
+        """
+        Add multiple modules to the list of required hypervisor modules.
+        """
+        self.modules.update(names)
+
     def __init__(self, config: dict) -> None:
         self.vnets = []
         self.vio_block = []
         self.modules = set()
+        # Name indexes of the registered objects
+        self._vnet_by_name: dict[str, VNet] = {}
+        self._vio_by_name: dict[str, VirtioBlock] = {}
+        self._vbus_by_name: dict[str, VBus] = {}
 
         super().__init__(config)
 
+        for vbus in self.vbus:
+            # Keep the first vbus if a name is used multiple times.
+            self._vbus_by_name.setdefault(vbus.name, vbus)
+
+        # Index of the shared memories by name
+        self._shm_index: dict[str, int] = {}
+        for i, shm in enumerate(self.shms):
+            self._shm_index.setdefault(shm.name, i)
+
         for vm in self.vms:
             vm.finalize(self)
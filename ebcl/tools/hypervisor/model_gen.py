@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import builtins
 import logging
+import sys
 from typing import Any, Type
 
 
@@ -11,6 +12,9 @@ class ConfigError(Exception):
 
 class PropertyInfo:
     """Information about a property of the configuration"""
+    __slots__ = (
+        "name", "type", "aggregate", "default", "optional", "enum_values", "is_enum", "_enum_set", "expected_type"
+    )
 
     name: str
     type: str
@@ -18,25 +22,34 @@ class PropertyInfo:
     default: Any
     optional: bool
     enum_values: list[str] | None
+    is_enum: bool
+    expected_type: Type | None
+    """Expected class type of a value, set by resolve"""
 
     def __init__(self, name: str, info: dict) -> None:
         self.name = name
-        self.type = info["type"]
-        self.aggregate = info.get("aggregate", "None")
+        # Interned, so that comparisons with the type names are identity checks
+        self.type = sys.intern(info["type"])
+        self.aggregate = sys.intern(info.get("aggregate", "None"))
         self.optional = info.get("optional", False)
         self.default = info.get("default", None)
         self.enum_values = info.get("enum_values", None)
+        self.is_enum = self.type == "enum"
+        self._enum_set = frozenset(self.enum_values or [])
+        self.expected_type = None
 
     def validate_enum(self, value: Any) -> bool:
         """
         Validate value of enum.
         Note: This is always true, it the type is not an enum
         """
-        if self.type != "enum":
+        if not self.is_enum:
             return True
-        if not isinstance(value, str) or not self.enum_values:
-            return False
-        return value in self.enum_values
+        return isinstance(value, str) and value in self._enum_set
+
+    def resolve(self, registry: dict[str, builtins.type[BaseModel]]) -> None:
+        """Look up the expected class type once all classes are registered"""
+        self.expected_type = self.get_type(registry)
 
     def get_type(self, registry: dict[str, builtins.type[BaseModel]]) -> Type | None:
         """Returns the expected class type of a value"""
@@ -53,20 +66,24 @@ class BaseModel:
     """
     Base class for all model classes
     """
+    # Allows classes generated from the schema to use __slots__ only.
+    __slots__ = ()
+
     class_registry: dict[str, type[BaseModel]] = {}
     PROPERTIES: list[PropertyInfo]
+    PROPERTY_NAMES: frozenset[str]
 
     def __init__(self, config: dict) -> None:
         self.__load(config)
 
     def __parse_type(self, info: PropertyInfo, value: Any) -> Any:
         """Verify that value matches the PropertyInfo"""
-        expected = info.get_type(self.class_registry)
+        expected = info.expected_type or info.get_type(self.class_registry)
 
         if not expected:
             raise ConfigError(f"Unexpected type for {type(self).__name__}.{info.name}: {info.type}")
 
-        if not info.validate_enum(value):
+        if info.is_enum and not info.validate_enum(value):
             raise ConfigError(
                 f"Invalid value for enum type {type(self).__name__}.{info.name}, "
                 f"expected one of {', '.join(info.enum_values or [])} but is '{value}"
@@ -90,11 +107,11 @@ class BaseModel:
                 info.name
             )
             value = [value]
-        setattr(self, info.name, list(map(lambda x: self.__parse_type(info, x), value)))
+        parse = self.__parse_type
+        setattr(self, info.name, [parse(info, x) for x in value])
 
     def __load(self, config: dict) -> None:
         """Load this instance from the config"""
-        used_keys = []
         for info in self.PROPERTIES:
             value = config.get(info.name, info.default)
             if value is None:
@@ -102,13 +119,12 @@ class BaseModel:
                     raise ConfigError(f"Property {info.name} for {type(self).__name__} is not optional")
                 setattr(self, info.name, None)
                 continue
-            used_keys.append(info.name)
 
             if info.aggregate == "list":
                 self.__load_list(info, value)
             else:
                 setattr(self, info.name, self.__parse_type(info, value))
 
-        unused_keys = set(config.keys()) - set(used_keys)
+        unused_keys = config.keys() - self.PROPERTY_NAMES
         if unused_keys:
             logging.warning("Some properties for %s are unused: %s", type(self).__name__, ", ".join(unused_keys))
@@ -1,18 +1,77 @@
 from __future__ import annotations
 
+import functools
+import hashlib
 import importlib.util
 import importlib.resources
+import json
 import logging
+import os
 from pathlib import Path
 import sys
 import types
-from typing import IO, Literal, Protocol
-import yaml
+from typing import IO, TYPE_CHECKING, Any, Literal, Protocol
+
+import ebcl
 
 from .model_gen import BaseModel, ConfigError, PropertyInfo
 from . import model
 from . import data
 
+if TYPE_CHECKING:
+    from importlib.resources.abc import Traversable
+
+
+# Marks keys missing in a dict
+_MISSING = object()
+
+
+def _load_yaml(stream: IO[str]) -> Any:
+    """Parse a yaml document, PyYAML is only imported if a schema is loaded"""
+    import yaml
+    try:
+        # Use the libyaml based loader if PyYAML was built with libyaml support.
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:
+        from yaml import SafeLoader  # type: ignore[assignment]
+    return yaml.load(stream, SafeLoader)
+
+
+@functools.lru_cache(maxsize=None)
+def _data_root() -> Traversable:
+    """Root of the data files of this module"""
+    return importlib.resources.files(data)
+
+
+# Loaded extension models by (realpath, mtime_ns, size) of the model.py.
+_EXT_MODELS: dict[tuple[str, int, int], types.ModuleType] = {}
+
+
+def _dir_sig(path: Path | None) -> tuple[int, int]:
+    """Signature of a directory tree, the sum of all mtimes and the number of files"""
+    mtimes = 0
+    count = 0
+    if path:
+        for root, _dirs, files in os.walk(path):
+            for name in [root, *(os.path.join(root, file) for file in files)]:
+                try:
+                    mtimes += os.stat(name).st_mtime_ns
+                except OSError:
+                    continue
+                count += 1
+    return (mtimes, count)
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_schema(extension: str | None, sig: tuple[int, int]) -> Schema:
+    """
+    Load the schema for an extension.
+
+    The sig is only part of the cache key, so that a changed
+    extension directory is loaded again.
+    """
+    return Schema(extension and Path(extension) or None)
+
 
 def merge_dict(old: dict, new: dict) -> None:
     """
@@ -20,24 +79,37 @@ def merge_dict(old: dict, new: dict) -> None:
     For existing values the behavior depends on the datatype:
         * strings, numbers and booleans are overwritten
         * lists are appended
-        * dicts are updated by recursively executing this function
-    """
-    def _merge_list(old: list, new: list) -> None:
-        old += new
+        * dicts are updated by merging them the same way
 
-    for key, value in new.items():
-        if key not in old:
-            old[key] = value
-        else:
-            if type(old[key]) is not type(value):
-                raise ConfigError(f"Type for {key} do not match ({type(old[key])} != {type(value)})")
+    Only old itself is modified. Nested lists and dicts are replaced by
+    merged copies instead of being modified, so both dictionaries may share
+    nested values with other configs, e.g. cached ones.
+    """
+    # Nested dicts are merged iteratively instead of recursively.
+    stack = [(old, new)]
+    while stack:
+        target, source = stack.pop()
+        if source.keys().isdisjoint(target):
+            # Nothing to merge, e.g. new sections of an extension.
+            target.update(source)
+            continue
+        for key, value in source.items():
+            existing = target.get(key, _MISSING)
+            if existing is _MISSING:
+                target[key] = value
+                continue
+
+            if type(existing) is not type(value):
+                raise ConfigError(f"Type for {key} do not match ({type(existing)} != {type(value)})")
 
             if isinstance(value, list):
-                _merge_list(old[key], value)
+                target[key] = existing + value
             elif isinstance(value, dict):
-                merge_dict(old[key], value)
+                merged = dict(existing)
+                target[key] = merged
+                stack.append((merged, value))
             elif isinstance(value, (str, int, bool)):
-                old[key] = value
+                target[key] = value
             else:
                 raise ConfigError(f"Unknown type for {key} ({type(value)})")
 
@@ -74,6 +146,9 @@ class FileReadProtocol(Protocol):
     def read_text(self, encoding: str | None = None) -> str:
         ...
 
+    def read_bytes(self) -> bytes:
+        ...
+
 
 class Schema:
     """
@@ -88,8 +163,10 @@ class Schema:
     extensions required for specific hypervisor versions.
     """
     _root: type[BaseModel]
+    _classes: dict[str, tuple[type[BaseModel], list[PropertyInfo]]]
     _templates: list[FileReadProtocol]
     _schema_version: int
+    _cache_key: str | None
 
     def __init__(self, extension: Path | None) -> None:
         schema = self._load_base_schema()
@@ -103,6 +180,8 @@ class Schema:
             if ext_model:
                 logging.info("Extension model loaded")
 
+        self._classes = {}
+        generated = False
         for key, value in schema.get("classes", {}).items():
             cls: type[BaseModel] | None = None
             if ext_model:
@@ -114,9 +193,18 @@ class Schema:
                 raise ConfigError(f"Class {cls.__name__} is not derived from BaseModel")
 
             if not cls:
-                cls = type(key, (BaseModel,), {})
-            cls.PROPERTIES = [PropertyInfo(key, info) for key, info in value.items()]
-            BaseModel.class_registry[key] = cls
+                generated = True
+                namespace = {}
+                if all(name.isidentifier() for name in value):
+                    # Generated classes only store their properties.
+                    namespace["__slots__"] = tuple(value)
+                cls = type(key, (BaseModel,), namespace)
+            self._classes[key] = (cls, [PropertyInfo(key, info) for key, info in value.items()])
+        self.activate()
+
+        for _cls, properties in self._classes.values():
+            for info in properties:
+                info.resolve(BaseModel.class_registry)
 
         root = schema.get("root")
         if not root or not isinstance(root, str) or root not in BaseModel.class_registry:
@@ -124,11 +212,43 @@ class Schema:
         self._root = BaseModel.class_registry[root]
         self._templates = self._load_templates(schema.get("templates", []), extension)
 
+        # Parsed configs can only be reused for the same schema and model,
+        # and classes generated from the schema can't be pickled.
+        self._cache_key = None
+        if not ext_model and not generated:
+            self._cache_key = hashlib.sha256(
+                (ebcl.__version__ + json.dumps(schema, sort_keys=True, default=str)).encode("utf-8")
+            ).hexdigest()
+
+    @classmethod
+    def get(cls, extension: Path | None) -> Schema:
+        """
+        Get the schema for an extension.
+
+        The schema is reused as long as the extension directory is unchanged.
+        """
+        schema = _cached_schema(extension and str(extension), _dir_sig(extension))
+        # Another schema may have been loaded since this one was cached.
+        schema.activate()
+        return schema
+
+    def activate(self) -> None:
+        """
+        Register the model classes and their properties of this schema.
+
+        The classes are registered globally, so this is required before
+        parsing a config if another schema was loaded in the meantime.
+        """
+        for key, (cls, properties) in self._classes.items():
+            cls.PROPERTIES = properties
+            cls.PROPERTY_NAMES = frozenset(info.name for info in properties)
+            BaseModel.class_registry[key] = cls
+
     def _load_base_schema(self) -> dict:
         """Load the schema.yaml from this module"""
-        schema_file = importlib.resources.files(data) / "schema.yaml"
+        schema_file = _data_root() / "schema.yaml"
         with schema_file.open(encoding="utf8") as f:
-            schema = yaml.load(f, yaml.Loader)
+            schema = _load_yaml(f)
         schema_version = schema.get("version", None)
 
         if not schema_version or not isinstance(schema_version, int):
@@ -139,11 +259,12 @@ class Schema:
     def _load_ext_schema(self, extension: Path) -> dict | None:
         """Load the schema.yaml from the extension path"""
         schema_file = extension / "schema.yaml"
-        if not schema_file.is_file():
+        try:
+            # Open directly instead of checking for the file first.
+            with schema_file.open(encoding="utf-8") as f:
+                schema = _load_yaml(f)
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
             return None
-
-        with schema_file.open(encoding="utf-8") as f:
-            schema = yaml.load(f, yaml.Loader)
         schema_ext_version = schema.get("version", None)
         if not schema_ext_version or not isinstance(schema_ext_version, int):
             raise ConfigError("Version missing in extension schema")
@@ -157,8 +278,14 @@ class Schema:
     def _load_ext_model(self, extension: Path) -> None | types.ModuleType:
         """Load the model.py from the extension path"""
         ext_model_file = extension / "model.py"
-        if not ext_model_file.exists():
+        try:
+            st = ext_model_file.stat()
+        except OSError:
             return None
+        key = (os.path.realpath(ext_model_file), st.st_mtime_ns, st.st_size)
+        ext_model = _EXT_MODELS.get(key)
+        if ext_model:
+            return ext_model
 
         spec = importlib.util.spec_from_file_location("ext_model", ext_model_file)
         if not spec or not spec.loader:
@@ -166,6 +293,7 @@ class Schema:
         ext_model = importlib.util.module_from_spec(spec)
         with DisablePycache():  # Disable creation of __pycache__ in extension dir
             spec.loader.exec_module(ext_model)
+        _EXT_MODELS[key] = ext_model
         return ext_model
 
     def _load_templates(self, templates: list[str], extension: Path | None) -> list[FileReadProtocol]:
@@ -179,7 +307,7 @@ class Schema:
             if ext_template and ext_template.is_file():
                 res.append(ext_template)
             else:
-                path = importlib.resources.files(data) / template
+                path = _data_root() / template
                 if not path.is_file():
                     raise ConfigError(f"Unable to find template {template}")
                 res.append(path)
@@ -190,6 +318,11 @@ class Schema:
         """Parse a hypervisor config with the current schema"""
         return self._root(config)
 
+    @property
+    def cache_key(self) -> str | None:
+        """Identifies the schema and model, None if parsed configs must not be cached"""
+        return self._cache_key
+
     @property
     def templates(self) -> list[FileReadProtocol]:
         """The templates defined in the schema"""
@@ -4,51 +4,110 @@
 from __future__ import annotations
 
 import argparse
-import glob
+import contextlib
+import errno
+import hashlib
+import json
 import logging
 import os
+import re
 import shutil
+import subprocess
 import tempfile
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Callable, Optional
+from typing import Any, BinaryIO, Callable, Iterable, Optional
 
-from ebcl.common import init_logging, promo, log_exception
+from ebcl.common import get_cache_folder, init_logging, promo, log_exception
 from ebcl.common.config import Config, InvalidConfiguration
+from ebcl.common.cpio import write_newc
 from ebcl.common.files import EnvironmentType
 from ebcl.common.templates import render_template
 from ebcl.common.version import parse_package
 
+# Module and dependencies of a modules.dep line, comments don't match.
+_DEPMOD_RE = re.compile(rb'^[ \t]*([^:#\s][^:\n]*):([^\n]*)', re.M)
+
+# Version of the cached modules.dep entries, to be increased if
+# the result of Modules._read_depmod changes.
+_DEPMOD_CACHE_FORMAT = 1
+
+# Folders of the initrd root filesystem.
+_SKELETON_DIRS = ('proc', 'sys', 'dev', 'sysroot', 'var', 'bin',
+                  'tmp', 'run', 'root', 'usr', 'sbin', 'lib', 'etc')
+
+# Image suffix and compressor commands, the first available one is used.
+_COMPRESSORS = {
+    'zstd': ('.zst', ['zstd -T0 -19 --no-progress -c']),
+    'gzip': ('.gz', ['pigz -9 -c', 'gzip -9 -c']),
+}
+
+
+def module_name(path: str) -> str:
+    """Get the module name from the path of a module file"""
+    return path.rsplit("/", 1)[-1].partition(".")[0]
+
+
+def _copy_module(src: str, dst: str) -> None:
+    """ Copy a module file in the kernel, if possible, owned by root with mode 644. """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        try:
+            copied = 0
+            while copied < size:
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+                if not n:
+                    break
+                copied += n
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            # copy_file_range is not supported, copy in user space
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            shutil.copyfileobj(fsrc, fdst)
+        os.fchown(fdst.fileno(), 0, 0)
+        os.fchmod(fdst.fileno(), 0o644)
+
 
 class Module:
-    path: Path
+    __slots__ = ("path", "dependencies", "is_builtin", "name")
+
+    path: str
     """Relative path of the module"""
     dependencies: list[Module]
     """List of all recursive dependencies of the module"""
     is_builtin: bool
     """Module is built into the kernel"""
+    name: str
+    """The name of the module (e.g. 'foo' for 'foo.ko' or 'foo.ko.zst')"""
 
-    def __init__(self, path: Path) -> None:
+    def __init__(self, path: str, name: str | None = None) -> None:
         self.path = path
         self.dependencies = []
         self.is_builtin = False
-
-    @property
-    def name(self) -> str:
-        """The name of the module (e.g. 'foo' for 'foo.ko')"""
-        return self.path.stem
+        self.name = name or module_name(path)
 
     @property
     def dependency_string(self) -> str:
-        return f"{self.path}: {' '.join(map(lambda x: str(x.path), self.dependencies))}"
+        if not self.dependencies:
+            return f"{self.path}:"
+        return f"{self.path}: {' '.join(x.path for x in self.dependencies)}"
 
 
 class Modules:
     """Kernel Module registry"""
     _modules: dict[str, Module]
+    _by_path: dict[str, Module]
+    _closures: dict[str, list[Module]]
+    _builtinmod_file: Path | None
 
     def __init__(self, base: Path, create_depmod: Callable[[], Any]) -> None:
         self._modules = {}
+        self._by_path = {}
+        self._closures = {}
 
         depmod_file = base / "modules.dep"
         if not depmod_file.exists():
@@ -59,52 +118,143 @@ class Modules:
         else:
             self._parse_depmod(depmod_file)
 
-        builtinmod_file = base / "modules.builtin"
-        if builtinmod_file.exists():
-            self._parse_builtinmod(builtinmod_file)
+        # Built-in modules are not part of modules.dep, so modules.builtin
+        # is only parsed if a module is not found.
+        self._builtinmod_file = base / "modules.builtin"
 
     def find(self, name: str) -> Module | None:
         """Find a module from a filename or module name"""
+        module = self._modules.get(name, None)
+        if module:
+            return module
+
         if name.endswith(".ko"):
-            mod_name = Path(name).stem
+            mod_name = module_name(name)
             logging.warning(
                 "Using deprecated filename format for modules (%s). Please use only the module name: %s",
                 name,
                 mod_name
             )
             name = mod_name
-        return self._modules.get(name, None)
+
+        module = self._modules.get(name, None)
+        if not module and self._load_builtinmod():
+            module = self._modules.get(name, None)
+        return module
+
+    def _load_builtinmod(self) -> bool:
+        """Parse modules.builtin, if not done yet. Returns True if it was parsed."""
+        builtinmod_file = self._builtinmod_file
+        if not builtinmod_file:
+            return False
+        self._builtinmod_file = None
+        if not builtinmod_file.exists():
+            return False
+        self._parse_builtinmod(builtinmod_file)
+        return True
+
+    def closure(self, module: Module) -> list[Module]:
+        """
+        Get the module and all its recursive dependencies.
+
+        The dependencies come before the modules requiring them.
+        """
+        closure = self._closures.get(module.name)
+        if closure is not None:
+            return closure
+
+        closure = []
+        visited = {module.name}
+        # Iterative depth first search, a module is added after its dependencies.
+        stack = [(module, iter(module.dependencies))]
+        while stack:
+            (current, dependencies) = stack[-1]
+            for dependency in dependencies:
+                if dependency.name not in visited:
+                    visited.add(dependency.name)
+                    stack.append((dependency, iter(dependency.dependencies)))
+                    break
+            else:
+                stack.pop()
+                closure.append(current)
+
+        self._closures[module.name] = closure
+        return closure
 
     def __get_or_create(self, mod: str,) -> Module:
-        modpath = Path(mod)
-        module = self._modules.get(modpath.stem, None)
+        module = self._by_path.get(mod, None)
+        if module:
+            return module
+
+        name = module_name(mod)
+        module = self._modules.get(name, None)
         if not module:
-            module = Module(modpath)
-            self._modules[module.name] = module
+            # The path string is shared with the path index.
+            module = Module(mod, name)
+            self._modules[name] = module
+        self._by_path[mod] = module
         return module
 
     def _parse_depmod(self, depmod: Path) -> None:
-        with depmod.open("r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith("#"):
-                    continue  # Skip comments
-                try:
-                    (mod, depends) = line.split(':', 1)
-                except ValueError:
-                    continue  # If there is no colon, the line is malformed
-                module = self.__get_or_create(mod)
-                for dependency in depends.split():
-                    module.dependencies.append(self.__get_or_create(dependency))
+        data = depmod.read_bytes()
+        # The parsed entries are cached by content, since the modules
+        # are usually extracted to a new temporary folder for each build.
+        cache_file = os.path.join(
+            get_cache_folder("depmod"),
+            f"v{_DEPMOD_CACHE_FORMAT}-{hashlib.sha256(data).hexdigest()}.json")
+
+        entries = self._load_depmod_cache(cache_file)
+        if entries is None:
+            entries = self._read_depmod(data)
+            self._store_depmod_cache(cache_file, entries)
+
+        get_or_create = self.__get_or_create
+        for (mod, depends) in entries:
+            get_or_create(mod).dependencies.extend(map(get_or_create, depends))
+
+    @staticmethod
+    def _read_depmod(data: bytes) -> list[tuple[str, list[str]]]:
+        """Get the modules and their dependencies from the modules.dep content"""
+        # Comments and malformed lines without a colon don't match.
+        return [
+            (mod.strip().decode("utf-8"), depends.decode("utf-8").split())
+            for (mod, depends) in _DEPMOD_RE.findall(data)
+        ]
+
+    @staticmethod
+    def _load_depmod_cache(cache_file: str) -> list[tuple[str, list[str]]] | None:
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            if all(isinstance(mod, str) and isinstance(depends, list) for (mod, depends) in entries):
+                return entries
+            logging.debug("Cached modules.dep %s is malformed.", cache_file)
+            return None
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.debug("Reading cached modules.dep %s failed! %s", cache_file, e)
+            return None
+
+    @staticmethod
+    def _store_depmod_cache(cache_file: str, entries: list[tuple[str, list[str]]]) -> None:
+        tmp_file = f"{cache_file}.{os.getpid()}"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_file, cache_file)
+        except Exception as e:
+            logging.debug("Caching modules.dep %s failed! %s", cache_file, e)
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
 
     def _parse_builtinmod(self, builtinmod: Path) -> None:
-        with builtinmod.open("r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith("#"):
-                    continue  # Skip comments
-                module = self.__get_or_create(line)
-                module.is_builtin = True
+        for line in builtinmod.read_text(encoding="utf-8").splitlines():
+            line = line.strip()
+            if line.startswith("#"):
+                continue  # Skip comments
+            module = self.__get_or_create(line)
+            module.is_builtin = True
 
 
 class InitrdGenerator:
@@ -118,7 +268,9 @@ class InitrdGenerator:
             config_file (Path): Path to the yaml config file.
         """
         self.config: Config = Config(config_file, output_path)
-        self.target_dir: str = self.config.target_dir
+        # The target is a mkdtemp folder, i.e. absolute, and paths are
+        # built using f-strings.
+        self.target_dir: str = self.config.target_dir.rstrip('/')
 
         if self.config.name:
             self.name: str = self.config.name + '.img'
@@ -165,16 +317,18 @@ class InitrdGenerator:
             return self.config.kernel_version
 
         kernel_dirs = os.path.abspath(os.path.join(mods_dir, 'lib', 'modules'))
-        versions = glob.glob(f'{kernel_dirs}/*')
+        try:
+            with os.scandir(kernel_dirs) as it:
+                versions = [entry.name for entry in it if not entry.name.startswith('.')]
+        except OSError:
+            versions = []
 
         if not versions:
             logging.critical(
                 'Kernel version not found! mods_dir: %s, kernel_dirs: %s', mods_dir, kernel_dirs)
             return None
 
-        versions.sort()
-
-        return os.path.basename(versions[-1])
+        return max(versions)
 
     def copy_modules(self, mods_dir: str) -> list[Module]:
         """ Copy the required modules.
@@ -200,7 +354,7 @@ class InitrdGenerator:
 
         mods_src_base = Path(mods_dir).absolute()
         mods_src = mods_src_base / 'lib' / 'modules' / kversion
-        mods_dst = Path(self.target_dir).absolute() / 'lib' / 'modules' / kversion
+        mods_dst = Path(f'{self.target_dir}/lib/modules/{kversion}')
         mods_dep_dst = mods_dst / 'modules.dep'
 
         modules = Modules(
@@ -214,7 +368,8 @@ class InitrdGenerator:
         self.config.fake.run_sudo(f'mkdir -p {mods_dst}')
 
         requested_modules: list[Module] = []
-        all_modules: set[Module] = set()
+        # Ordered set of all required modules
+        all_modules: dict[Module, None] = {}
         for module_name in self.config.modules:
             mod = modules.find(module_name)
             if not mod:
@@ -223,39 +378,74 @@ class InitrdGenerator:
             if mod.is_builtin:
                 logging.info("Module %s is built into the kernel.", mod.name)
             else:
-                all_modules.add(mod)
-                all_modules.update(mod.dependencies)
+                all_modules.update(dict.fromkeys(modules.closure(mod)))
                 requested_modules.append(mod)
 
-        for module in all_modules:
-            logging.info('Processing module %s...', module.name)
+        if all_modules:
+            # String bases, to avoid Path objects per module.
+            mods_src_str = str(mods_src)
+            mods_dst_str = str(mods_dst)
 
-            src = mods_src / module.path
-            dst = mods_dst / module.path
+            # Create all module folders at once.
+            dst_dirs = sorted({
+                os.path.dirname(f'{mods_dst_str}/{module.path}') for module in all_modules
+            })
+            self.config.fake.run_sudo(f'mkdir -p {" ".join(dst_dirs)}')
 
-            self.config.fh.copy_file(
-                src=str(src),
-                dst=str(dst),
-                environment=EnvironmentType.SUDO,
-                uid=0,
-                gid=0,
-                mode='644'
-            )
+            def install_module(module: Module) -> None:
+                logging.info('Processing module %s...', module.name)
+
+                src = f'{mods_src_str}/{module.path}'
+                dst = f'{mods_dst_str}/{module.path}'
 
-            # Create entry in modules.dep file
-            self.config.fake.run_sudo(f'echo {module.dependency_string} >> {mods_dep_dst}')
+                if os.geteuid() == 0:
+                    # No sudo and cp processes required.
+                    _copy_module(src, dst)
+                    return
+
+                self.config.fh.copy_file(
+                    src=src,
+                    dst=dst,
+                    environment=EnvironmentType.SUDO,
+                    uid=0,
+                    gid=0,
+                    mode='644'
+                )
+
+            # The copies are independent and mostly wait for the sudo processes.
+            workers = min(32, (os.cpu_count() or 1) * 4, len(all_modules))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(install_module, all_modules))
+
+            self._write_modules_dep(all_modules, mods_dep_dst)
 
         return requested_modules
 
+    def _write_modules_dep(self, modules: Iterable[Module], mods_dep_dst: Path) -> None:
+        """ Append the modules.dep entries of all modules with a single sudo call.
+
+        The modules.dep of a base tarball is extended, not replaced.
+        """
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.dep', delete=False) as f:
+            for module in modules:
+                f.write(f'{module.dependency_string}\n')
+            dep_file = f.name
+
+        try:
+            self.config.fake.run_sudo(f'cat {dep_file} >> {mods_dep_dst}')
+        finally:
+            os.remove(dep_file)
+
     def add_devices(self) -> None:
         """ Create device files. """
-        self.config.fake.run_sudo(f'mkdir -p {self.target_dir}/dev')
+        dev_folder = f'{self.target_dir}/dev'
 
-        dev_folder = os.path.join(self.target_dir, 'dev')
+        # All device nodes are created by a single sudo call.
+        cmds = [f'mkdir -p {dev_folder}']
 
         for device in self.config.devices:
             major = (int)(device['major'])
-            minor = (int)(device['major'])
+            minor = (int)(device['minor'])
 
             if device['type'] == 'char':
                 dev_type = 'c'
@@ -268,13 +458,12 @@ class InitrdGenerator:
                               device['type'], device['name'])
                 continue
 
-            self.config.fake.run_sudo(
-                f'mknod -m {mode} {dev_folder}/{device["name"]} {dev_type} {major} {minor}')
-
             uid = device.get('uid', '0')
-            gid = device.get('uid', '0')
-            self.config.fake.run_sudo(
-                f'chown {uid}:{gid} {dev_folder}/{device["name"]}')
+            gid = device.get('gid', '0')
+            cmds.append(f'mknod -m {mode} {dev_folder}/{device["name"]} {dev_type} {major} {minor}')
+            cmds.append(f'chown {uid}:{gid} {dev_folder}/{device["name"]}')
+
+        self.config.fake.run_sudo(' && '.join(cmds))
 
     def download_deb_packages(self, allow_missing=False) -> None:
         """ Download all needed deb packages. """
@@ -290,32 +479,8 @@ class InitrdGenerator:
             logging.critical('Not found packages: %s', missing)
             raise InvalidConfiguration(f'Not found packages: {missing}')
 
-    @log_exception()
-    def create_initrd(self) -> Optional[str]:
-        """ Create the initrd image.  """
-        image_path = os.path.join(self.config.output_path, self.name)
-
-        logging.info('Installing busybox...')
-
-        success = self.install_busybox()
-        if not success:
-            return None
-
-        self.download_deb_packages()
-
-        # Create necessary directories
-        for dir_name in ['proc', 'sys', 'dev', 'sysroot', 'var', 'bin',
-                         'tmp', 'run', 'root', 'usr', 'sbin', 'lib', 'etc']:
-            self.config.fake.run_sudo(
-                f'mkdir -p {os.path.join(self.target_dir, dir_name)}')
-            self.config.fake.run_sudo(
-                f'chown 0:0 {os.path.join(self.target_dir, dir_name)}')
-
-        if self.config.base_tarball:
-            base_tarball = self.config.base_tarball
-            logging.info('Extracting base tarball %s...', base_tarball)
-            self.config.fh.extract_tarball(base_tarball, self.target_dir)
-
+    def _get_modules_dir(self) -> Optional[str]:
+        """ Get the folder containing the kernel modules, download them if needed. """
         mods_dir = None
         if self.config.modules_folder:
             mods_dir = self.config.modules_folder
@@ -338,6 +503,95 @@ class InitrdGenerator:
         else:
             logging.info('No module sources defined.')
 
+        return mods_dir
+
+    def _get_compressor(self) -> tuple[str, Optional[str]]:
+        """ Get the image suffix and the command compressing stdin to stdout. """
+        compression = self.config.compression
+        if not compression:
+            return ('', None)
+
+        if compression not in _COMPRESSORS:
+            raise InvalidConfiguration(f'Unsupported initrd compression {compression}!')
+
+        (suffix, cmds) = _COMPRESSORS[compression]
+        for cmd in cmds:
+            if shutil.which(cmd.split(' ', 1)[0]):
+                return (suffix, cmd)
+
+        raise InvalidConfiguration(f'No tool for initrd compression {compression} found!')
+
+    def _write_image(self, img: BinaryIO, compressor: Optional[str]) -> None:
+        """ Write the target folder as cpio archive to img. """
+        if os.geteuid() != 0:
+            cmd = 'find . -print0 | cpio --null -ov --format=newc'
+            if compressor:
+                # Without pipefail, the status of the compressor would hide cpio errors.
+                cmd = f'set -o pipefail; {cmd} | {compressor}'
+            self.config.fake.run_sudo(cmd, cwd=self.target_dir, stdout=img)
+            return
+
+        # All files are readable, no sudo and cpio processes required.
+        if not compressor:
+            write_newc(self.target_dir, img)
+            return
+
+        # The archive is compressed while it is written, no second pass needed.
+        broken_pipe: Optional[BrokenPipeError] = None
+        with subprocess.Popen(compressor, shell=True, stdin=subprocess.PIPE,
+                              stdout=img, bufsize=1024 * 1024) as proc:
+            stdin = proc.stdin
+            assert stdin
+            try:
+                write_newc(self.target_dir, stdin)
+                stdin.close()
+            except BrokenPipeError as e:
+                # The compressor exited early, its exit status is checked below.
+                broken_pipe = e
+                with contextlib.suppress(OSError):
+                    stdin.close()
+            except BaseException:
+                # Report the archive error, not the aborted compressor.
+                proc.kill()
+                with contextlib.suppress(OSError):
+                    stdin.close()
+                raise
+
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, compressor)
+        if broken_pipe:
+            raise broken_pipe
+
+    @log_exception()
+    def create_initrd(self) -> Optional[str]:
+        """ Create the initrd image.  """
+        (suffix, compressor) = self._get_compressor()
+        image_path = os.path.join(self.config.output_path, self.name + suffix)
+
+        logging.info('Installing busybox...')
+
+        success = self.install_busybox()
+        if not success:
+            return None
+
+        self.download_deb_packages()
+
+        # The proxy is free now, download the kernel modules while the
+        # skeleton is created and the base tarball is extracted.
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            mods_future = pool.submit(self._get_modules_dir)
+
+            # Create necessary directories
+            dirs = ' '.join(f'{self.target_dir}/{dir_name}' for dir_name in _SKELETON_DIRS)
+            self.config.fake.run_sudo(f'mkdir -p {dirs} && chown 0:0 {dirs}')
+
+            if self.config.base_tarball:
+                base_tarball = self.config.base_tarball
+                logging.info('Extracting base tarball %s...', base_tarball)
+                self.config.fh.extract_tarball(base_tarball, self.target_dir)
+
+            mods_dir = mods_future.result()
+
         if self.config.modules and mods_dir:
             logging.info('Adding modules %s...', self.config.modules)
             requested_modules = self.copy_modules(mods_dir)
@@ -347,7 +601,7 @@ class InitrdGenerator:
 
         if mods_dir and not self.config.modules_folder:
             # Remove mods temporary folder
-            self.config.fake.run_sudo(f'rm -rf {mods_dir}', check=False)
+            self._remove_folder(mods_dir, check=False)
 
         # Add device nodes
         self.add_devices()
@@ -356,7 +610,7 @@ class InitrdGenerator:
         self.config.fh.copy_files(self.config.host_files, self.target_dir)
 
         # Create init script
-        init_script: Path = Path(self.target_dir) / 'init'
+        init_script = Path(f'{self.target_dir}/init')
 
         if self.config.template:
             template = self.config.template
@@ -386,9 +640,8 @@ class InitrdGenerator:
 
         # Create initrd image
         os.makedirs(os.path.dirname(image_path), exist_ok=True)
-        with open(image_path, 'wb') as img:
-            self.config.fake.run_sudo(
-                'find . -print0 | cpio --null -ov --format=newc', cwd=self.target_dir, stdout=img)
+        with open(image_path, 'wb', buffering=1024 * 1024) as img:
+            self._write_image(img, compressor)
 
         return image_path
 
@@ -397,7 +650,16 @@ class InitrdGenerator:
         """ Finalize output and cleanup. """
 
         # delete temporary folder
-        self.config.fake.run_sudo(f' rm -rf {self.target_dir}')
+        self._remove_folder(self.target_dir)
+
+    def _remove_folder(self, folder: str, check: bool = True) -> None:
+        """ Remove a folder which may contain files owned by root. """
+        if os.geteuid() == 0:
+            # All files can be removed, no sudo and rm processes required.
+            if os.path.lexists(folder):
+                shutil.rmtree(folder, ignore_errors=not check)
+        else:
+            self.config.fake.run_sudo(f'rm -rf --one-file-system {folder}', check=check)
 
 
 @log_exception(call_exit=True)
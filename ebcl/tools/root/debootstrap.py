@@ -4,6 +4,7 @@ import logging
 import os
 import hashlib
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List
 
 from ebcl.common import get_cache_folder
@@ -71,42 +72,44 @@ class DebootstrapRootGenerator:
 
         fake = self.config.fake
 
-        fake.run_sudo(
-            f'mkdir -p {apt_conf}',
-            cwd=self.config.target_dir,
-            check=True
-        )
-
+        # apt_key_dir is below apt_conf, one mkdir creates both.
         fake.run_sudo(
             f'mkdir -p {apt_key_dir}',
             cwd=self.config.target_dir,
             check=True
         )
 
+        # Download and dearmor the repo keys concurrently.
+        apt_repos = self.config.apt_repos
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(apt_repos)))) as pool:
+            key_files = list(pool.map(lambda apt: apt.get_key_files(), apt_repos))
+
+        # Keys to copy, in repo order and without duplicates.
+        keys: dict[str, None] = {}
+
         with open(apt_sources, mode='w', encoding='utf-8') as f:
-            for apt in self.config.apt_repos:
+            for apt, (key_pub_file, key_gpg_file) in zip(apt_repos, key_files):
                 logging.info('Adding apt repo %s...', str(apt))
 
                 # Copy key if available
-                (key_pub_file, key_gpg_file) = apt.get_key_files()
                 if key_pub_file:
                     os.remove(key_pub_file)
 
                 trusted = False
                 if key_gpg_file and os.path.isfile(key_gpg_file):
-                    fake.run_sudo(
-                        f'cp {key_gpg_file} {apt_key_dir}',
-                        cwd=self.config.target_dir,
-                        check=True
-                    )
+                    keys[key_gpg_file] = None
                 else:
                     logging.warning('No GPG key for %s, will trust the repo!', apt)
                     trusted = True
 
                 f.write(f'{apt.repo.sources_entry(trusted=trusted)}\n\n')
 
+        # Copy all keys and the sources.list with a single sudo call.
+        cmd = f'cp {apt_sources} {apt_sources_target}'
+        if keys:
+            cmd = f'cp {" ".join(keys)} {apt_key_dir} && {cmd}'
         fake.run_sudo(
-            f'cp {apt_sources} {apt_sources_target}',
+            cmd,
             cwd=self.config.target_dir,
             check=True
         )
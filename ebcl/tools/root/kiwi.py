@@ -10,6 +10,12 @@ from typing import Optional, Any
 
 import yaml
 
+try:
+    # Use the libyaml based dumper if PyYAML was built with libyaml support.
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper  # type: ignore[assignment]
+
 from ebcl.common.config import Config
 from ebcl.common.templates import render_template
 
@@ -174,10 +180,9 @@ def _generate_berrymill_config(
     config_file = os.path.join(result_dir, 'berrymill.conf')
 
     try:
+        logging.debug('Berrymill configuration: %s', berrymill_conf)
         with open(config_file, 'w', encoding='utf-8') as f:
-            data = yaml.dump(berrymill_conf)
-            logging.debug('Berrymill configuration: %s', data)
-            f.write(data)
+            yaml.dump(berrymill_conf, f, Dumper=SafeDumper)
     except Exception as e:
         logging.critical('Saving berrymill.conf failed! %s', e)
         return None
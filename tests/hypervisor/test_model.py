@@ -1,11 +1,13 @@
+import pickle
 import re
 import pytest
 from pathlib import Path
 from typing import Any, TypeGuard
 
-from ebcl.tools.hypervisor.config_gen import HvFileGenerator
+from ebcl.tools.hypervisor.config_gen import BaseResolver, HvFileGenerator
 from ebcl.tools.hypervisor.model import HVConfig, VNetRef, VirtioBlockRef
 from ebcl.tools.hypervisor.model_gen import ConfigError
+from ebcl.tools.hypervisor.schema_loader import Schema
 
 test_data = Path(__file__).parent / "data"
 
@@ -81,10 +83,9 @@ def test_shm(tmp_path: Path) -> None:
     # Ensure sorting of shms works as expected
     # i.e.: First shms with fixed address in address order then all others
     sorted_shms = sorted(gen.config.shms)
-    sorted_shms[0].name == "shm_4"
-    sorted_shms[0].name == "shm_3"
-    sorted_shms[0].name == "shm_1"
-    sorted_shms[0].name == "shm_2"
+    assert [shm.name for shm in sorted_shms] == ["shm_4", "shm_3", "shm_1", "shm_2"]
+    sorted_shms = sorted(gen.config.shms, key=lambda shm: shm.sort_key)
+    assert [shm.name for shm in sorted_shms] == ["shm_4", "shm_3", "shm_1", "shm_2"]
 
 
 def test_vms(tmp_path: Path) -> None:
@@ -252,3 +253,126 @@ def test_missing_shms(tmp_path: Path) -> None:
         match="^" + re.escape("VM vm_1: The following shared memory segments are not defined: shm_3, shm_4") + "$"
     ):
         HvFileGenerator(str(test_data / "test_missing_shms.yaml"), str(tmp_path))
+
+
+def test_base_resolver_cache(tmp_path: Path) -> None:
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text("a: 1\n")
+
+    config = BaseResolver().load(config_file.name, str(tmp_path))
+    assert config["a"] == 1
+    config["a"] = 2
+    assert BaseResolver().load(config_file.name, str(tmp_path))["a"] == 1
+
+    config_file.write_text("a: 10\n")
+    assert BaseResolver().load(config_file.name, str(tmp_path))["a"] == 10
+
+
+def test_base_resolver_json_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("EBCL_YAML_CACHE", "1")
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    (tmp_path / "base.yaml").write_text("a: 1\nb: 1\n")
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text("base: [base.yaml]\nb: 2\n")
+
+    config = BaseResolver().load(config_file.name, str(tmp_path))
+    assert config["a"] == 1 and config["b"] == 2
+    assert BaseResolver().load(config_file.name, str(tmp_path)) == config
+
+    (tmp_path / "base.yaml").write_text("a: 10\nb: 1\n")
+    assert BaseResolver().load(config_file.name, str(tmp_path))["a"] == 10
+
+
+def test_base_resolver_order(tmp_path: Path) -> None:
+    (tmp_path / "config.yaml").write_text("base: [a.yaml, b.yaml]\nl: [config]\nv: config\n")
+    (tmp_path / "a.yaml").write_text("base: [c.yaml]\nl: [a]\nv: a\n")
+    (tmp_path / "b.yaml").write_text("l: [b]\nv: b\nw: b\n")
+    (tmp_path / "c.yaml").write_text("l: [c]\nv: c\nw: c\n")
+
+    config = BaseResolver().load("config.yaml", str(tmp_path))
+    assert config == {"l": ["b", "c", "a", "config"], "v": "config", "w": "c"}
+
+
+def test_base_resolver_shared_bases(tmp_path: Path) -> None:
+    (tmp_path / "base.yaml").write_text("d:\n  l: [base]\n  v: base\n")
+    (tmp_path / "a.yaml").write_text("base: [base.yaml]\nd:\n  l: [a]\n")
+    (tmp_path / "b.yaml").write_text("base: [base.yaml]\nd:\n  v: b\n")
+
+    resolver = BaseResolver()
+    assert resolver.load("a.yaml", str(tmp_path)) == {"d": {"l": ["base", "a"], "v": "base"}}
+    # The cached base must not be modified by merging a.yaml
+    assert resolver.load("b.yaml", str(tmp_path)) == {"d": {"l": ["base"], "v": "b"}}
+
+
+def test_model_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("EBCL_YAML_CACHE", "1")
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+
+    gen = HvFileGenerator(str(test_data / "test_vms.yaml"), str(tmp_path))
+    assert [vm.name for vm in gen.config.vms] == ["vm_1", "vm_2"]
+
+    cache_folder = next((tmp_path / "home").glob("**/models-*"))
+    assert cache_folder.stat().st_mode & 0o777 == 0o700
+    assert len(list(cache_folder.glob("*.model.pkl"))) == 1
+
+    def parse_config(self: Schema, config: dict) -> None:
+        raise AssertionError("The model was not loaded from the cache")
+
+    monkeypatch.setattr(Schema, "parse_config", parse_config)
+    gen = HvFileGenerator(str(test_data / "test_vms.yaml"), str(tmp_path))
+    assert isinstance(gen.config, HVConfig)
+    assert [vm.name for vm in gen.config.vms] == ["vm_1", "vm_2"]
+
+
+def test_model_cache_generated_classes(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("EBCL_YAML_CACHE", "1")
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    extension = tmp_path / "extension"
+    extension.mkdir()
+    (extension / "schema.yaml").write_text(
+        "version: 1\n"
+        "classes:\n"
+        "  Generated:\n"
+        "    value:\n"
+        "      type: integer\n"
+    )
+
+    gen = HvFileGenerator(str(test_data / "test_vms.yaml"), str(tmp_path / "out"), str(extension))
+    assert gen.schema.cache_key is None
+    assert not list((tmp_path / "home").glob("**/*.model.pkl"))
+
+
+def test_model_pickle(tmp_path: Path) -> None:
+    gen = HvFileGenerator(str(test_data / "test_vnets.yaml"), str(tmp_path))
+    config = pickle.loads(pickle.dumps(gen.config))
+    assert isinstance(config, HVConfig)
+    assert [vnet.name for vnet in config.vms[0].vnets] == ["vnet_1", "vnet_2", "vnet_3"]
+
+
+def test_schema_cache(tmp_path: Path) -> None:
+    gen_1 = HvFileGenerator(str(test_data / "empty.yaml"), str(tmp_path))
+    gen_2 = HvFileGenerator(str(test_data / "empty.yaml"), str(tmp_path))
+    assert gen_1.schema is gen_2.schema
+
+
+def test_extension_class(tmp_path: Path) -> None:
+    extension = tmp_path / "extension"
+    extension.mkdir()
+    (extension / "schema.yaml").write_text(
+        "version: 1\n"
+        "classes:\n"
+        "  HVConfig:\n"
+        "    extra:\n"
+        "      type: Extra\n"
+        "      optional: true\n"
+        "  Extra:\n"
+        "    value:\n"
+        "      type: integer\n"
+    )
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text("extra:\n  value: 1\n")
+
+    gen = HvFileGenerator(str(config_file), str(tmp_path / "out"), str(extension))
+    extra = gen.config.extra  # type: ignore[attr-defined]
+    assert extra.value == 1
+    assert not hasattr(extra, "__dict__")
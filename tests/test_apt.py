@@ -1,7 +1,11 @@
 """ Tests for the apt functions. """
 import os
+import shutil
 
 from pathlib import Path
+
+import pytest
+
 from ebcl.common.apt import Apt, AptDebRepo, AptFlatRepo
 from ebcl.common.proxy import Proxy
 from ebcl.common.version import Version, VersionRelation, parse_depends
@@ -120,12 +124,71 @@ class TestApt:
         assert p
         assert p[0].name == 'busybox-static'
         assert p[0].file_url is not None
+        assert p[0].sha256 == '595826b8f7a94971cfe717000762dcaa956849d1ffbdbeee7e5f4c2a9e4bfed1'
 
         pkg = self.proxy.download_package(self.apt.arch, p[0])
         assert pkg
         assert pkg.local_file
         assert os.path.isfile(pkg.local_file)
 
+    def test_parsed_index_cache(self, tmp_path: Path):
+        """ Parsed package indices are cached. """
+        def flat_repo() -> AptFlatRepo:
+            return AptFlatRepo(
+                url='file://' + (test_data / "flat_repo").as_posix(),
+                directory=".",
+                arch=CpuArch.AMD64
+            )
+
+        apt = Apt(flat_repo(), state_folder=tmp_path.as_posix())
+        p = apt.find_package('busybox-static')
+        assert p
+        assert list(tmp_path.glob('parsed-*/*.parsed_*'))
+
+        apt = Apt(flat_repo(), state_folder=tmp_path.as_posix())
+        c = apt.find_package('busybox-static')
+        assert c
+        assert c[0].name == p[0].name
+        assert c[0].version == p[0].version
+        assert c[0].file_url == p[0].file_url
+
+    def test_parsed_index_cache_private(self, tmp_path: Path):
+        """ Parsed package indices are only cached in a folder private to the user. """
+        def flat_apt() -> Apt:
+            return Apt(AptFlatRepo(
+                url='file://' + (test_data / "flat_repo").as_posix(),
+                directory=".",
+                arch=CpuArch.AMD64
+            ), state_folder=tmp_path.as_posix())
+
+        assert flat_apt().find_package('busybox-static')
+        (folder,) = tmp_path.glob('parsed-*')
+        assert folder.stat().st_mode & 0o777 == 0o700
+
+        # A folder accessible by others is not used.
+        shutil.rmtree(folder)
+        folder.mkdir(mode=0o777)
+        folder.chmod(0o777)
+        assert flat_apt().find_package('busybox-static')
+        assert not list(folder.iterdir())
+
+    def test_parsed_index_cache_format(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """ Parsed package indices of another format are not used. """
+        def flat_apt() -> Apt:
+            return Apt(AptFlatRepo(
+                url='file://' + (test_data / "flat_repo").as_posix(),
+                directory=".",
+                arch=CpuArch.AMD64
+            ), state_folder=tmp_path.as_posix())
+
+        assert flat_apt().find_package('busybox-static')
+        assert [p.name.rsplit('_', 1)[-1][:3] for p in tmp_path.glob('parsed-*/*.parsed_*')] == ['v1-']
+
+        # The index is parsed again and stored for the new format.
+        monkeypatch.setattr('ebcl.common.apt._INDEX_CACHE_FORMAT', 2)
+        assert flat_apt().find_package('busybox-static')
+        assert [p.name.rsplit('_', 1)[-1][:3] for p in tmp_path.glob('parsed-*/*.parsed_*')] == ['v2-']
+
     def test_local_file_download(self, tmp_path: Path):
         apt = Apt(
             AptFlatRepo(
@@ -176,6 +239,8 @@ class TestApt:
             )
         )
         assert a == b
+        assert hash(a) == hash(b)
+        assert len({a, b}) == 1
 
         b = Apt(
             AptDebRepo(
@@ -1,8 +1,11 @@
 """ Tests for config helpers. """
+import hashlib
 import os
 import shutil
 import tempfile
 
+import pytest
+
 from ebcl.common.apt import AptDebRepo, AptFlatRepo
 from ebcl.common.config import Config
 from ebcl.common.files import EnvironmentType
@@ -54,6 +57,34 @@ class TestConfig:
         assert config.scripts[0]['name'] == os.path.join(
             os.path.dirname(__file__), 'data', 'config_boot.sh')
 
+    def test_load_yaml_cache(self, monkeypatch: pytest.MonkeyPatch):
+        """ Test that a parsed config is cached and reloaded. """
+        yaml_file = os.path.join(
+            os.path.dirname(__file__), 'data', 'boot.yaml')
+
+        cache_folder = tempfile.mkdtemp()
+        monkeypatch.setattr('ebcl.common.config.get_cache_folder', lambda _folder: cache_folder)
+
+        config = Config(yaml_file, self.temp_dir)
+
+        data = config._load_yaml(yaml_file)
+
+        stat = os.stat(yaml_file)
+        key = hashlib.sha1(os.path.abspath(yaml_file).encode('utf-8')).hexdigest()
+        assert os.path.isfile(os.path.join(cache_folder, f'{key}-{stat.st_mtime_ns}-{stat.st_size}.json'))
+
+        def load_yaml(*_args, **_kwargs):
+            raise AssertionError('Config was not loaded from the cache!')
+
+        monkeypatch.setattr('ebcl.common.config.yaml.load', load_yaml)
+
+        cached = config._load_yaml(yaml_file)
+
+        assert data
+        assert data == cached
+
+        shutil.rmtree(cache_folder)
+
     def test_initrd_yaml(self):
         """ Try to parse initrd.yaml. """
         yaml_file = os.path.join(
@@ -0,0 +1,58 @@
+""" Tests for the cpio writer. """
+import io
+import os
+import stat
+import tempfile
+
+from ebcl.common.cpio import write_newc
+
+
+def _read_newc(data: bytes) -> dict[str, tuple[int, bytes]]:
+    """ Get the mode and content of all entries of a newc archive. """
+    entries = {}
+    offset = 0
+    while True:
+        assert data[offset:offset + 6] == b'070701'
+        fields = [int(data[offset + 6 + i * 8:offset + 14 + i * 8], 16) for i in range(13)]
+        mode = fields[1]
+        size = fields[6]
+        name_size = fields[11]
+        name_start = offset + 110
+        name = data[name_start:name_start + name_size - 1].decode()
+        data_start = name_start + name_size + (-(110 + name_size) % 4)
+        if name == 'TRAILER!!!':
+            break
+        entries[name] = (mode, data[data_start:data_start + size])
+        offset = data_start + size + (-size % 4)
+    assert len(data) % 512 == 0
+    return entries
+
+
+class TestCpio:
+    """ Tests for the cpio writer. """
+
+    def test_write_newc(self):
+        """ Test that files, folders and links are archived. """
+        root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(root, 'bin'))
+        os.makedirs(os.path.join(root, 'etc', 'init.d'))
+        with open(os.path.join(root, 'bin', 'busybox'), 'wb') as f:
+            f.write(b'\x7fELF busybox')
+        os.chmod(os.path.join(root, 'bin', 'busybox'), 0o755)
+        with open(os.path.join(root, 'init'), 'w', encoding='utf-8') as f:
+            f.write('#!/bin/sh\n')
+        os.symlink('busybox', os.path.join(root, 'bin', 'sh'))
+
+        out = io.BytesIO()
+        write_newc(root, out)
+        entries = _read_newc(out.getvalue())
+
+        assert list(entries) == [
+            '.', './bin', './etc', './init', './bin/busybox', './bin/sh', './etc/init.d'
+        ]
+        assert stat.S_ISDIR(entries['.'][0])
+        assert stat.S_ISDIR(entries['./etc/init.d'][0])
+        assert entries['./bin/busybox'] == (stat.S_IFREG | 0o755, b'\x7fELF busybox')
+        assert entries['./init'][1] == b'#!/bin/sh\n'
+        assert stat.S_ISLNK(entries['./bin/sh'][0])
+        assert entries['./bin/sh'][1] == b'busybox'
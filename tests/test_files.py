@@ -5,11 +5,14 @@ import shutil
 
 from typing import Any
 
+import pytest
+
 from ebcl.common.apt import Apt, AptDebRepo
 from ebcl.common.fake import Fake
 from ebcl.common.files import (
     Files, EnvironmentType,
-    parse_scripts, parse_files
+    parse_scripts, parse_files,
+    _tar_compress_program
 )
 from ebcl.common.proxy import Proxy
 from ebcl.common.types.cpu_arch import CpuArch
@@ -37,6 +40,24 @@ class TestEnvironmentType:
         assert str(env) == 'shell'
 
 
+class TestTarCompression:
+    """ Tests for the selection of the tar compressor. """
+
+    def test_compress_program(self, monkeypatch: pytest.MonkeyPatch):
+        """ The compressor is selected by the archive extension. """
+        monkeypatch.setattr(shutil, 'which', lambda cmd: f'/usr/bin/{cmd}')
+        assert _tar_compress_program('root.tar') is None
+        assert _tar_compress_program('root.tar.zst') == 'zstd -T0 -3'
+        assert _tar_compress_program('root.txz') == 'xz -T0'
+        assert (_tar_compress_program('root.tar.gz') or '').startswith('pigz ')
+
+    def test_compress_program_fallback(self, monkeypatch: pytest.MonkeyPatch):
+        """ Missing compressors fall back to gzip or to no compression. """
+        monkeypatch.setattr(shutil, 'which', lambda cmd: '/usr/bin/gzip' if cmd == 'gzip' else None)
+        assert _tar_compress_program('root.tar.gz') == 'gzip'
+        assert _tar_compress_program('root.tar.zst') is None
+
+
 class TestFiles:
     """ Tests for the files functions. """
 
@@ -421,6 +442,94 @@ class TestFiles:
         assert out
         assert '0 0 644' in out.strip()
 
+    def test_copy_files_override(self):
+        """ A file overrides a file of a folder copied before. """
+        src = tempfile.mkdtemp()
+        dst = tempfile.mkdtemp()
+
+        self.fake.run_cmd(f'mkdir -p {src}/conf')
+        self.fake.run_cmd(f'echo "folder" > {src}/conf/foo.conf')
+        self.fake.run_cmd(f'echo "folder" > {src}/conf/bar.conf')
+        self.fake.run_cmd(f'echo "override" > {src}/foo.conf')
+        self.fake.run_cmd(f'mkdir -p {dst}/etc')
+
+        files = self.files.copy_files([
+            {'source': f'{src}/conf/*', 'destination': 'etc'},
+            {'source': f'{src}/foo.conf', 'destination': 'etc/foo.conf'},
+        ], dst)
+        assert files[-1] == f'{dst}/etc/foo.conf'
+
+        with open(f'{dst}/etc/foo.conf', encoding='utf-8') as f:
+            assert f.read().strip() == 'override'
+        with open(f'{dst}/etc/bar.conf', encoding='utf-8') as f:
+            assert f.read().strip() == 'folder'
+
+        shutil.rmtree(src)
+        self.fake.run_sudo(f'rm -rf {dst}')
+
+    def test_move_dir_contents(self):
+        """ Move the content of a folder. """
+        src = tempfile.mkdtemp()
+        dst = tempfile.mkdtemp()
+
+        self.fake.run_cmd(f'mkdir -p {src}/adir/subdir')
+        self.fake.run_cmd(f'echo "new" > {src}/adir/subdir/a')
+        self.fake.run_cmd(f'echo "new" > {src}/file')
+        self.fake.run_cmd(f'echo "old" > {dst}/file')
+
+        files = self.files.move_dir_contents(src, dst)
+        assert sorted(files) == [f'{dst}/adir', f'{dst}/file']
+
+        assert not os.listdir(src)
+        assert os.path.isfile(f'{dst}/adir/subdir/a')
+        with open(f'{dst}/file', encoding='utf-8') as f:
+            assert f.read().strip() == 'new'
+
+        shutil.rmtree(src)
+        shutil.rmtree(dst)
+
+    def test_move_dir_contents_existing_dir(self):
+        """ Move a folder into an existing folder of the same name. """
+        src = tempfile.mkdtemp()
+        dst = tempfile.mkdtemp()
+
+        self.fake.run_cmd(f'mkdir -p {src}/boot/sub {dst}/boot')
+        self.fake.run_cmd(f'echo "new" > {src}/boot/x')
+        self.fake.run_cmd(f'echo "new" > {src}/boot/sub/y')
+        self.fake.run_cmd(f'echo "old" > {dst}/boot/x')
+        self.fake.run_cmd(f'echo "old" > {dst}/boot/keep')
+
+        files = self.files.move_dir_contents(src, dst)
+        assert files == [f'{dst}/boot']
+
+        assert not os.listdir(src)
+        assert not os.path.exists(f'{dst}/boot/boot')
+        with open(f'{dst}/boot/x', encoding='utf-8') as f:
+            assert f.read().strip() == 'new'
+        assert os.path.isfile(f'{dst}/boot/sub/y')
+        assert os.path.isfile(f'{dst}/boot/keep')
+
+        shutil.rmtree(src)
+        shutil.rmtree(dst)
+
+    def test_clone_files(self):
+        """ Clone files to the same relative path. """
+        src = tempfile.mkdtemp()
+        dst = tempfile.mkdtemp()
+
+        self.fake.run_cmd(f'mkdir -p {src}/adir/subdir')
+        self.fake.run_cmd(f'echo "a" > {src}/adir/subdir/a')
+        self.fake.run_cmd(f'echo "b" > {src}/b')
+        self.fake.run_cmd(f'chmod 600 {src}/b')
+
+        self.files.clone_files(
+            [f'{src}/adir/subdir/a', f'{src}/b'], src, dst)
+
+        assert os.path.isfile(f'{dst}/adir/subdir/a')
+        assert oct(os.stat(f'{dst}/b').st_mode)[-3:] == '600'
+
+        self.fake.run_sudo(f'rm -rf {src} {dst}')
+
     def test_copy_file_delete(self):
         """ Copy a file and delete old first. """
         files = self.files.copy_file(
@@ -676,6 +785,26 @@ class TestFiles:
 
         self.fake.run_sudo(f'rm -rf {temp}', check=False)
 
+    def test_extract_tarball_target_mode(self):
+        """ Test that the extraction keeps the mode of the target folder. """
+        tar = os.path.join(os.path.dirname(__file__),
+                           'data', 'data.tar.zst')
+
+        temp = tempfile.mkdtemp()
+        os.chmod(temp, 0o755)
+
+        # New fakeroot state, the shared state may know a reused inode.
+        Files(fake=Fake()).extract_tarball(
+            archive=tar,
+            directory=temp,
+            use_sudo=False)
+
+        assert os.path.isfile(f'{temp}/bin/busybox')
+        assert oct(os.stat(temp).st_mode & 0o777) == oct(0o755)
+        assert os.stat(temp).st_uid == os.getuid()
+
+        self.fake.run_sudo(f'rm -rf {temp}', check=False)
+
     def test_pack_root_as_tarball(self):
         """ Test for tarball packing. """
         tar = os.path.join(os.path.dirname(__file__),
@@ -728,6 +857,32 @@ class TestFiles:
         self.fake.run_sudo(f'rm -rf {tempdir}', check=False)
         self.fake.run_sudo(f'rm -rf {outdir}', check=False)
 
+    def test_pack_root_as_tarball_compressed(self):
+        """ Test that tar.gz archives are compressed. """
+        tempdir = tempfile.mkdtemp()
+        self.fake.run_cmd(f'echo "content" > {tempdir}/file')
+
+        outdir = tempfile.mkdtemp()
+        archive = self.files.pack_root_as_tarball(
+            output_dir=outdir,
+            archive_name='myroot.tar.gz',
+            root_dir=tempdir,
+            use_sudo=False
+        )
+        assert archive
+
+        with open(archive, 'rb') as f:
+            assert f.read(2) == b'\x1f\x8b'
+
+        (out, _err, ret) = self.fake.run_cmd(
+            f'tar --list --gzip --file={archive}', capture_output=True)
+        assert ret == 0
+        assert out
+        assert './file' in out
+
+        shutil.rmtree(tempdir)
+        shutil.rmtree(outdir)
+
 
 class TestParsers:
     """ Tests for the config parser functions. """
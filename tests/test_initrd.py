@@ -1,13 +1,16 @@
 """ Unit tests for the EBcL initrd generator. """
+import gzip
 import os
+import subprocess
 import tempfile
 
 from pathlib import Path
+from types import SimpleNamespace
 
 import pytest
 
 from ebcl.common.fake import Fake
-from ebcl.tools.initrd.initrd import InitrdGenerator
+from ebcl.tools.initrd.initrd import InitrdGenerator, Modules
 from ebcl.common.version import VersionDepends
 
 from ebcl.common.types.cpu_arch import CpuArch
@@ -42,6 +45,15 @@ class TestInitrd:
         assert generator.config.arch == CpuArch.ARM64
         assert generator.config.root_device == '/dev/mmcblk0p2'
 
+    def test_find_kernel_version(self):
+        """ Test that the latest kernel version is found. """
+        mods_dir = tempfile.mkdtemp()
+        for version in ['5.15.0-1023-s32-eb', '5.15.0-1034-s32-eb', '.hidden']:
+            os.makedirs(os.path.join(mods_dir, 'lib', 'modules', version))
+
+        assert self.generator.find_kernel_version(mods_dir) == '5.15.0-1034-s32-eb'
+        assert self.generator.find_kernel_version(tempfile.mkdtemp()) is None
+
     @pytest.mark.requires_download
     def test_install_busybox(self):
         """ Test yaml config loading. """
@@ -197,6 +209,25 @@ class TestInitrd:
         assert not err.strip()
 
     @pytest.mark.requires_download
+    def test_write_modules_dep(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """ Test that the modules.dep entries are appended. """
+        monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+        modules_dep = tmp_path / 'modules.dep'
+        modules_dep.write_text('kernel/base.ko:\n')
+
+        base = tmp_path / 'modules'
+        base.mkdir()
+        (base / 'modules.dep').write_text('kernel/a.ko: kernel/b.ko\nkernel/b.ko:\n')
+        modules = Modules(base, lambda: None)
+        a = modules.find('a')
+        assert a
+
+        self.generator._write_modules_dep(modules.closure(a), modules_dep)
+
+        assert sorted(modules_dep.read_text().splitlines()) == [
+            'kernel/a.ko: kernel/b.ko', 'kernel/b.ko:', 'kernel/base.ko:'
+        ]
+
     def test_initrd_is_created(self):
         """ Test that the initrd.img is created. """
         out = tempfile.mkdtemp()
@@ -210,3 +241,170 @@ class TestInitrd:
         assert file_stats.st_size > 10
 
         self.fake.run_sudo(f'rm -rf {out}', check=False)
+
+
+class TestModules:
+    """ Unit tests for the kernel module registry. """
+
+    def test_depmod_cache(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """ Test that the parsed modules.dep is cached. """
+        monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+        base = tmp_path / 'modules'
+        base.mkdir()
+        (base / 'modules.dep').write_text(
+            '# comment\n'
+            'kernel/a.ko: kernel/b.ko kernel/c.ko\n'
+            'kernel/b.ko: kernel/c.ko\n'
+            'kernel/c.ko:\n'
+        )
+
+        for _ in range(2):
+            modules = Modules(base, lambda: None)
+            a = modules.find('a')
+            assert a
+            assert [str(m.path) for m in a.dependencies] == ['kernel/b.ko', 'kernel/c.ko']
+            assert a.dependency_string == 'kernel/a.ko: kernel/b.ko kernel/c.ko'
+            c = modules.find('c')
+            assert c
+            assert c.dependency_string == 'kernel/c.ko:'
+            # The second registry is loaded from the cache.
+            monkeypatch.setattr(Modules, '_read_depmod', None)
+
+        # The cache files are versioned.
+        assert [f.name[:3] for f in (tmp_path / 'home').glob('**/depmod/*.json')] == ['v1-']
+
+    def test_depmod_cache_malformed(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """ Test that a malformed cache file is ignored. """
+        monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+        base = tmp_path / 'modules'
+        base.mkdir()
+        (base / 'modules.dep').write_text('kernel/a.ko: kernel/b.ko\nkernel/b.ko:\n')
+
+        Modules(base, lambda: None)
+        cache_files = list((tmp_path / 'home').glob('**/depmod/*.json'))
+        assert len(cache_files) == 1
+        cache_files[0].write_text('{"kernel/a.ko": 1}')
+
+        a = Modules(base, lambda: None).find('a')
+        assert a
+        assert a.dependency_string == 'kernel/a.ko: kernel/b.ko'
+
+    def test_closure(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """ Test that the recursive dependencies are resolved. """
+        monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+        base = tmp_path / 'modules'
+        base.mkdir()
+        (base / 'modules.dep').write_text(
+            'kernel/a.ko: kernel/b.ko\n'
+            'kernel/b.ko: kernel/c.ko kernel/d.ko\n'
+            'kernel/c.ko: kernel/d.ko\n'
+            'kernel/d.ko:\n'
+        )
+
+        modules = Modules(base, lambda: None)
+        a = modules.find('a')
+        assert a
+        closure = modules.closure(a)
+        assert [m.name for m in closure] == ['d', 'c', 'b', 'a']
+        assert modules.closure(a) is closure
+
+    def test_module_names(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """ Test that modules are found by name and by deprecated file name. """
+        monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+        base = tmp_path / 'modules'
+        base.mkdir()
+        (base / 'modules.dep').write_text(
+            'kernel/drivers/a.ko.zst: kernel/lib/b.ko\n'
+            'kernel/lib/b.ko:\n'
+        )
+
+        modules = Modules(base, lambda: None)
+        a = modules.find('a')
+        assert a
+        assert str(a.path) == 'kernel/drivers/a.ko.zst'
+        assert a.dependencies == [modules.find('b')]
+        assert modules.find('kernel/lib/b.ko') is a.dependencies[0]
+        assert modules.find('c') is None
+
+    def test_builtin_modules(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """ Test that modules.builtin is only parsed if required. """
+        monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+        base = tmp_path / 'modules'
+        base.mkdir()
+        (base / 'modules.dep').write_text('kernel/a.ko:\n')
+        (base / 'modules.builtin').write_text('kernel/b.ko\n')
+
+        modules = Modules(base, lambda: None)
+        a = modules.find('a')
+        assert a
+        assert not a.is_builtin
+
+        b = modules.find('b')
+        assert b
+        assert b.is_builtin
+
+
+class TestImage:
+    """ Tests for writing the initrd image. """
+
+    @pytest.mark.skipif(os.geteuid() != 0, reason='The in-process writer is only used as root.')
+    def test_compressed_image(self, tmp_path: Path):
+        """ Test that the archive is compressed while it is written. """
+        target = tmp_path / 'target'
+        target.mkdir()
+        (target / 'init').write_text('#!/bin/sh\n')
+
+        generator = InitrdGenerator.__new__(InitrdGenerator)
+        generator.target_dir = str(target)
+        generator.config = SimpleNamespace(compression='gzip')  # type: ignore[assignment]
+
+        (suffix, compressor) = generator._get_compressor()
+        assert suffix == '.gz'
+        assert compressor
+
+        image = tmp_path / f'initrd.img{suffix}'
+        with open(image, 'wb') as img:
+            generator._write_image(img, compressor)
+
+        data = gzip.decompress(image.read_bytes())
+        assert data.startswith(b'070701')
+        assert b'./init\0' in data
+        assert len(data) % 512 == 0
+
+    @pytest.mark.skipif(os.geteuid() != 0, reason='The in-process writer is only used as root.')
+    def test_compressor_failure(self, tmp_path: Path):
+        """ Test that a failing compressor fails the image creation. """
+        target = tmp_path / 'target'
+        target.mkdir()
+        (target / 'init').write_bytes(os.urandom(4 * 1024 * 1024))
+
+        generator = InitrdGenerator.__new__(InitrdGenerator)
+        generator.target_dir = str(target)
+
+        with open(tmp_path / 'initrd.img', 'wb') as img:
+            with pytest.raises(subprocess.CalledProcessError):
+                generator._write_image(img, 'exit 3')
+
+    @pytest.mark.skipif(os.geteuid() != 0, reason='The in-process writer is only used as root.')
+    def test_archive_failure(self, tmp_path: Path):
+        """ Test that archive errors are not hidden by the compressor. """
+        generator = InitrdGenerator.__new__(InitrdGenerator)
+        generator.target_dir = str(tmp_path / 'missing')
+
+        with open(tmp_path / 'initrd.img', 'wb') as img:
+            with pytest.raises(FileNotFoundError):
+                generator._write_image(img, 'gzip -c')
+
+    def test_compressed_image_pipefail(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        """ Test that cpio errors are not hidden by the compressor. """
+        commands: list[str] = []
+        generator = InitrdGenerator.__new__(InitrdGenerator)
+        generator.target_dir = str(tmp_path)
+        generator.config = SimpleNamespace(  # type: ignore[assignment]
+            fake=SimpleNamespace(run_sudo=lambda cmd, **_kwargs: commands.append(cmd)))
+        monkeypatch.setattr(os, 'geteuid', lambda: 1000)
+
+        with open(tmp_path / 'initrd.img', 'wb') as img:
+            generator._write_image(img, 'gzip -c')
+
+        assert commands == ['set -o pipefail; find . -print0 | cpio --null -ov --format=newc | gzip -c']
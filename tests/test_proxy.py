@@ -1,15 +1,93 @@
 """ Unit tests for the EBcL apt proxy. """
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+
 from pathlib import Path
 
 import pytest
+import requests
 
-from ebcl.common.apt import Apt, AptDebRepo
+from ebcl.common.apt import Apt, AptDebRepo, AptFlatRepo
+from ebcl.common.cache import Cache
+from ebcl.common.deb import Package
+from ebcl.common.fake import Fake
 from ebcl.common.proxy import Proxy
 
 from ebcl.common.types.cpu_arch import CpuArch
 from ebcl.common.version import parse_depends
 
 
+def _write_deb(path: str, files: dict[str, bytes]) -> None:
+    """ Write a minimal deb containing files as data.tar. """
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w') as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+
+    with open(path, 'wb') as f:
+        f.write(b'!<arch>\n')
+        for name, content in [('debian-binary', b'2.0\n'), ('data.tar', data.getvalue())]:
+            f.write(f'{name:<16}{0:<12}{0:<6}{0:<6}{644:<8}{len(content):<10}`\n'.encode())
+            f.write(content + b'\n' * (len(content) % 2))
+
+
+class _FakeResponse:
+    """ Minimal streamed requests response. """
+
+    def __init__(self, status_code: int, content: bytes, headers: dict[str, str], broken: bool = False) -> None:
+        self.status_code = status_code
+        self.reason = 'test'
+        self.headers = headers
+        self._content = content
+        self._broken = broken
+
+    def iter_content(self, chunk_size: int):
+        for start in range(0, len(self._content), chunk_size):
+            yield self._content[start:start + chunk_size]
+            if self._broken:
+                raise requests.exceptions.ChunkedEncodingError('Connection reset by peer')
+
+    def close(self) -> None:
+        pass
+
+
+class _FakeSession:
+    """ Minimal requests session serving data from memory. """
+
+    def __init__(self, data: bytes, ranges: bool = True, short: bool = False, broken: bool = False) -> None:
+        self.data = data
+        self.ranges = ranges
+        self.short = short
+        self.broken = broken
+        self.requests: list[str] = []
+        self._lock = threading.Lock()
+
+    def get(self, _url: str, headers: dict[str, str] | None = None, **_kwargs) -> _FakeResponse:
+        value = (headers or {}).get('Range')
+        with self._lock:
+            self.requests.append(value or 'full')
+
+        if value and self.ranges:
+            (start, end) = (int(x) for x in value.removeprefix('bytes=').split('-'))
+            content = self.data[start:end + 1]
+            if self.short:
+                content = content[:-1]
+            return _FakeResponse(206, content, {'Content-Length': str(len(content))})
+
+        return _FakeResponse(200, self.data, {
+            'Content-Length': str(len(self.data)),
+            'Accept-Ranges': 'bytes'
+        }, self.broken)
+
+
 class TestProxy:
     """ Unit tests for the EBcL apt proxy. """
 
@@ -141,6 +219,185 @@ class TestProxy:
         p = Proxy().find_package(vds[0])
         assert p is None
 
+    def test_download_deb_packages_workdir(self) -> None:
+        """ Test that the workdir sub-folders are used for debs and contents. """
+        workdir = tempfile.mkdtemp()
+
+        (debs, contents, missing) = Proxy().download_deb_packages([], workdir=workdir)
+
+        assert not missing
+        assert debs == os.path.join(workdir, 'debs')
+        assert contents == os.path.join(workdir, 'contents')
+        assert os.path.isdir(debs)
+        assert os.path.isdir(contents)
+
+        shutil.rmtree(workdir)
+
+    def test_download_deb_packages_skip_extracted(self) -> None:
+        """ Test that debs with an extraction stamp are not extracted again. """
+        workdir = tempfile.mkdtemp()
+        stamp_dir = os.path.join(workdir, 'contents', '.extracted')
+        os.makedirs(stamp_dir)
+        sha256 = '595826b8f7a94971cfe717000762dcaa956849d1ffbdbeee7e5f4c2a9e4bfed1'
+        with open(os.path.join(stamp_dir, f'{sha256}.stamp'), 'w', encoding='utf-8'):
+            pass
+
+        proxy = Proxy([Apt(AptFlatRepo(
+            url='file://' + os.path.join(os.path.dirname(__file__), 'data', 'flat_repo'),
+            directory='.',
+            arch=CpuArch.AMD64
+        ))])
+        vds = parse_depends('busybox-static', CpuArch.AMD64)
+        assert vds
+        (_debs, contents, missing) = proxy.download_deb_packages(
+            vds, workdir=workdir, skip_extracted=True)
+
+        assert not missing
+        assert contents
+        assert os.listdir(contents) == ['.extracted']
+
+        shutil.rmtree(workdir)
+
+    def test_download_deb_packages_extraction_order(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """ Test that the debs are extracted in resolution order, not download order. """
+        repo = tempfile.mkdtemp()
+        _write_deb(os.path.join(repo, 'first.deb'), {'./etc/conf': b'first'})
+        _write_deb(os.path.join(repo, 'second.deb'), {'./etc/conf': b'second'})
+
+        proxy = Proxy()
+
+        def find_package(vd):
+            return Package(vd.name, CpuArch.AMD64, 'test', file_url=f'file://{repo}/{vd.name}.deb')
+
+        def fetch_package(package, _location):
+            if package.name == 'first':
+                # The first package is available last.
+                time.sleep(0.5)
+            package.local_file = os.path.join(repo, f'{package.name}.deb')
+            return package
+
+        monkeypatch.setattr(proxy, 'find_package', find_package)
+        monkeypatch.setattr(proxy, '_cached_package', lambda *_args: None)
+        monkeypatch.setattr(proxy, '_resolve_package_url', lambda _arch, package, _relation: package)
+        monkeypatch.setattr(proxy, '_fetch_package', fetch_package)
+
+        vds = parse_depends('first', CpuArch.AMD64) + parse_depends('second', CpuArch.AMD64)
+        (debs, contents, missing) = proxy.download_deb_packages(vds)
+
+        assert not missing
+        assert contents
+        with open(os.path.join(contents, 'etc', 'conf'), 'rb') as f:
+            assert f.read() == b'second'
+
+        shutil.rmtree(repo)
+        shutil.rmtree(debs)
+        # The content is extracted using sudo.
+        Fake().run_sudo(f'rm -rf {contents}')
+
+    def _fetch_ranged(self, monkeypatch: pytest.MonkeyPatch, session: _FakeSession) -> tuple[str, Package | None]:
+        """ Fetch a package using session, with ranged downloads for all sizes. """
+        proxy = Proxy()
+        monkeypatch.setattr(proxy, '_session', session)
+        monkeypatch.setattr(proxy, 'RANGED_DOWNLOAD_THRESHOLD', 0)
+
+        location = tempfile.mkdtemp()
+        package = Package('test', CpuArch.AMD64, 'test', file_url='http://localhost/test.deb',
+                          sha256=hashlib.sha256(session.data).hexdigest())
+        return (location, proxy._fetch_package(package, location))
+
+    def test_fetch_package_ranged(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """ Test a download using range requests. """
+        session = _FakeSession(os.urandom(1024 * 1024 + 3))
+        (location, package) = self._fetch_ranged(monkeypatch, session)
+
+        assert package
+        assert package.local_file
+        assert Path(package.local_file).read_bytes() == session.data
+        # One request for the headers, then one per part.
+        assert session.requests[0] == 'full'
+        assert sorted(session.requests[1:]) == sorted([
+            'bytes=0-262144', 'bytes=262145-524289', 'bytes=524290-786434', 'bytes=786435-1048578'
+        ])
+
+        shutil.rmtree(location)
+
+    def test_fetch_package_ranges_ignored(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """ Test the fallback to a single stream if the server ignores the range requests. """
+        session = _FakeSession(os.urandom(1024 * 1024), ranges=False)
+        (location, package) = self._fetch_ranged(monkeypatch, session)
+
+        assert package
+        assert package.local_file
+        assert Path(package.local_file).read_bytes() == session.data
+        # The last request is the single stream fallback.
+        assert session.requests[-1] == 'full'
+        assert len(session.requests) == 2 + Proxy.RANGED_DOWNLOAD_PARTS
+
+        shutil.rmtree(location)
+
+    def test_fetch_package_ranged_short_read(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """ Test the fallback to a single stream if a range is incomplete. """
+        session = _FakeSession(os.urandom(1024 * 1024), short=True)
+
+        proxy = Proxy()
+        monkeypatch.setattr(proxy, '_session', session)
+        location = tempfile.mkdtemp()
+        assert not proxy._download_ranged('http://localhost/test.deb', os.path.join(location, 'test.deb'),
+                                          len(session.data))
+        shutil.rmtree(location)
+
+        session.requests.clear()
+        (location, package) = self._fetch_ranged(monkeypatch, session)
+
+        assert package
+        assert package.local_file
+        assert Path(package.local_file).read_bytes() == session.data
+        assert session.requests[-1] == 'full'
+
+        shutil.rmtree(location)
+
+    def test_download_package_checksum_mismatch(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """ Test that a package with a wrong SHA256 checksum is rejected and not cached. """
+        folder = tempfile.mkdtemp()
+        cache = Cache(Path(folder))
+        proxy = Proxy(cache=cache)
+        monkeypatch.setattr(proxy, '_session', _FakeSession(b'corrupted deb'))
+        monkeypatch.setattr(proxy, '_resolve_package_url', lambda _arch, package, _relation: package)
+
+        package = Package('test', CpuArch.AMD64, 'test', file_url='http://localhost/test_1.0_amd64.deb',
+                          sha256=hashlib.sha256(b'original deb').hexdigest())
+
+        assert proxy.download_package(CpuArch.AMD64, package) is None
+        assert not [f for f in os.listdir(folder) if f.endswith('.deb')]
+        assert cache.size() == 0
+        assert cache.get(CpuArch.AMD64, 'test') is None
+
+        shutil.rmtree(folder)
+
+    def test_download_package_connection_error(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """ Test that a download failing midway is logged, removed and not cached. """
+        folder = tempfile.mkdtemp()
+        cache = Cache(Path(folder))
+        proxy = Proxy(cache=cache)
+        monkeypatch.setattr(proxy, '_resolve_package_url', lambda _arch, package, _relation: package)
+
+        package = Package('test', CpuArch.AMD64, 'test', file_url='http://localhost/test_1.0_amd64.deb')
+
+        # Single stream download.
+        monkeypatch.setattr(proxy, '_session', _FakeSession(os.urandom(1024 * 1024), broken=True))
+        assert proxy.download_package(CpuArch.AMD64, package) is None
+        assert not [f for f in os.listdir(folder) if f.endswith('.deb')]
+
+        # Single stream fallback of a failed ranged download.
+        monkeypatch.setattr(proxy, '_session', _FakeSession(os.urandom(1024 * 1024), short=True, broken=True))
+        monkeypatch.setattr(proxy, 'RANGED_DOWNLOAD_THRESHOLD', 0)
+        assert proxy.download_package(CpuArch.AMD64, package) is None
+        assert not [f for f in os.listdir(folder) if f.endswith('.deb')]
+
+        assert cache.size() == 0
+
+        shutil.rmtree(folder)
+
     @pytest.mark.requires_download
     def test_download_and_extract_linux_image(self) -> None:
         """ Extract data content of multiple debs. """